@@ -76,7 +76,7 @@ async def get_file(
 
     if row["s3_key"]:
         try:
-            result["download_url"] = generate_presigned_url(row["s3_key"])
+            result["download_url"] = generate_presigned_url(row["s3_key"], filename=row["name"])
         except Exception:
             result["download_url"] = None
     else:
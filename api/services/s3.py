@@ -5,6 +5,8 @@ Presigned URL generation for S3 file downloads.
 The browser hits S3 directly — no bandwidth cost on the API server.
 """
 import os
+from typing import Optional
+from urllib.parse import quote
 
 import boto3
 from botocore.exceptions import ClientError
@@ -22,17 +24,22 @@ def _client():
     return _s3
 
 
-def generate_presigned_url(s3_key: str, ttl: int = 3600) -> str:
+def generate_presigned_url(s3_key: str, ttl: int = 3600, filename: Optional[str] = None) -> str:
     """
     Return a presigned GET URL for an S3 object.
 
     ttl: seconds until the URL expires (default 1 hour).
+    filename: name the browser saves the download as — objects are stored
+    under a content hash, so without it the file would be named after that.
     Raises ClientError if the key doesn't exist or permissions fail.
     """
     bucket = os.environ["S3_BUCKET"]
+    params = {"Bucket": bucket, "Key": s3_key}
+    if filename:
+        params["ResponseContentDisposition"] = f"attachment; filename*=UTF-8''{quote(filename)}"
     url = _client().generate_presigned_url(
         "get_object",
-        Params={"Bucket": bucket, "Key": s3_key},
+        Params=params,
         ExpiresIn=ttl,
     )
     return url
@@ -19,6 +19,7 @@ from src.auth import get_bearer_token
 from src.db import init_pool, get_system_token
 from src.graph_client import GraphClient
 from src.teams_scraper import scrape_all
+from src import storage
 
 log = logging.getLogger("backup_teams")
 
@@ -44,9 +45,18 @@ async def _async_main(token: str = None) -> None:
         await pool.close()
         return
 
+    async def refresh_token() -> str:
+        # Called by GraphClient when a long scrape outlives the token.
+        if os.getenv("SERVER_MODE", "").lower() == "true":
+            return await get_system_token(pool, os.environ.get("EMAIL"))
+        return await asyncio.to_thread(get_bearer_token)
+
     log.info("Step 3/4 — Starting scrape across all teams…")
-    async with GraphClient(token) as graph:
-        stats = await scrape_all(graph, pool)
+    try:
+        async with GraphClient(token, token_provider=refresh_token) as graph:
+            stats = await scrape_all(graph, pool)
+    finally:
+        await storage.close()
 
     log.info("Step 4/4 — Indexing new PDFs for full-text search…")
     indexed_count = await run_incremental(pool)
@@ -11,29 +11,59 @@ Design:
 import os
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from uuid import UUID
 
 import asyncpg
 
 log = logging.getLogger("backup_teams.db")
 
+POOL_MIN_SIZE = 10
 
-# ─── Pool lifecycle ────────────────────────────────────────────────────────────
 
-async def init_pool() -> asyncpg.Pool:
+def _pool_max_size() -> int:
     """
-    Create an asyncpg connection pool.
-    Reads DB_* variables from the environment.
-    Schema must already be applied via `alembic upgrade head`.
+    The same pool serves the scraper (downloads) and the indexer, so size it
+    for whichever of the two runs wider. Each download also fans out etag and
+    archive queries, hence the 4x headroom over the worker count. Read when
+    the pool is created, so values loaded from .env after import count.
     """
+    concurrency = max(
+        int(os.getenv("DOWNLOAD_CONCURRENCY", "4")),
+        int(os.getenv("INDEX_CONCURRENCY", "4")),
+    )
+    return max(POOL_MIN_SIZE, concurrency * 4)
+
+
+# ─── Pool lifecycle ────────────────────────────────────────────────────────────
+
+def dsn_from_env(sslmode: Optional[str] = None) -> str:
+    """Build the Postgres DSN from the DB_* environment variables."""
     dsn = (
         f"postgresql://{os.environ['DB_USER']}"
         f"{(':' + os.environ['DB_PASSWORD']) if os.environ.get('DB_PASSWORD') else ''}"
         f"@{os.environ.get('DB_HOST', 'localhost')}:{os.environ.get('DB_PORT', '5432')}"
         f"/{os.environ['DB_NAME']}"
     )
-    pool = await asyncpg.create_pool(dsn, min_size=2, max_size=10)
+    return f"{dsn}?sslmode={sslmode}" if sslmode else dsn
+
+
+async def init_pool() -> asyncpg.Pool:
+    """
+    Create an asyncpg connection pool.
+    Reads DB_* variables from the environment (see dsn_from_env).
+    Schema must already be applied via `alembic upgrade head`.
+    """
+    pool = await asyncpg.create_pool(
+        dsn_from_env(),
+        min_size=POOL_MIN_SIZE,
+        max_size=_pool_max_size(),
+        max_queries=50_000,                     # recycle long-lived connections
+        max_inactive_connection_lifetime=300,
+        statement_cache_size=1024,
+        max_cached_statement_lifetime=0,
+        command_timeout=60,
+    )
     log.info("Database pool initialised.")
     return pool
 
@@ -62,118 +92,161 @@ async def upsert_professor(
 
 # ─── Curso ─────────────────────────────────────────────────────────────────────
 
-async def upsert_curso(
+async def upsert_cursos(
     pool: asyncpg.Pool,
-    *,
-    name: str,
-    teams_id: str,
-) -> UUID:
-    """Insert a curso (Teams Team) if not already present; return its UUID."""
+    rows: List[Tuple[str, str]],
+) -> Dict[str, UUID]:
+    """
+    Insert a curso (Teams Team) for each (name, teams_id) pair, renaming
+    those already present, in one statement. Returns {teams_id: curso UUID};
+    duplicate teams_ids keep the last name.
+    """
+    by_key = {teams_id: name for name, teams_id in rows}
+    if not by_key:
+        return {}
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(
+        records = await conn.fetch(
             """
             INSERT INTO curso (name, teams_id)
-            VALUES ($1, $2)
+            SELECT * FROM UNNEST($1::text[], $2::text[])
             ON CONFLICT (teams_id) DO UPDATE SET name = EXCLUDED.name
-            RETURNING id
+            RETURNING teams_id, id
             """,
-            name, teams_id,
+            list(by_key.values()), list(by_key),
         )
-    return row["id"]
+    return {r["teams_id"]: r["id"] for r in records}
 
 
 # ─── Class ─────────────────────────────────────────────────────────────────────
 
-async def upsert_class(
+async def upsert_classes(
     pool: asyncpg.Pool,
-    *,
-    name: str,
-    curso_id: UUID,
-    professor_id: Optional[UUID],
-    semester: str,
-    class_year: int,
-    teams_channel_id: str,
-) -> UUID:
-    """Insert or update a class (Teams Channel); return its UUID."""
+    rows: List[dict],
+) -> Dict[str, UUID]:
+    """
+    Insert or update every class (Teams Channel) in one statement.
+
+    Each row is a dict of name, curso_id, professor_id (may be None),
+    semester, class_year and teams_channel_id. Returns
+    {teams_channel_id: class UUID}. Rows are deduplicated by
+    teams_channel_id (last wins) since ON CONFLICT cannot touch a row twice.
+    """
+    by_key = {r["teams_channel_id"]: r for r in rows}
+    if not by_key:
+        return {}
+    cols = list(zip(*(
+        (r["name"], r["curso_id"], r["professor_id"], r["semester"], r["class_year"], key)
+        for key, r in by_key.items()
+    )))
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(
+        records = await conn.fetch(
             """
             INSERT INTO class
                 (name, curso_id, professor_id, semester, class_year, teams_channel_id)
-            VALUES ($1, $2, $3, $4, $5, $6)
+            SELECT * FROM UNNEST($1::text[], $2::uuid[], $3::uuid[], $4::text[], $5::int[], $6::text[])
             ON CONFLICT (teams_channel_id) DO UPDATE
                 SET name         = EXCLUDED.name,
                     professor_id = EXCLUDED.professor_id,
                     semester     = EXCLUDED.semester,
                     class_year   = EXCLUDED.class_year
-            RETURNING id
+            RETURNING teams_channel_id, id
             """,
-            name, curso_id, professor_id, semester, class_year, teams_channel_id,
+            *map(list, cols),
         )
-    return row["id"]
+    return {r["teams_channel_id"]: r["id"] for r in records}
+
+
+# ─── Id checks ─────────────────────────────────────────────────────────────────
+
+async def fetch_existing_ids(pool: asyncpg.Pool, table: str, ids: List[str]) -> set:
+    """
+    The subset of `ids` (UUID strings) that still has a row in `table`,
+    one of professor / curso / class.
+    """
+    if table not in ("professor", "curso", "class"):
+        raise ValueError(f"unexpected table {table!r}")
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            f"SELECT id::text AS id FROM {table} WHERE id = ANY($1::uuid[])",
+            ids,
+        )
+    return {row["id"] for row in rows}
 
 
 # ─── Archive ───────────────────────────────────────────────────────────────────
 
-async def get_archive_etag(
+async def fetch_class_etags(
     pool: asyncpg.Pool,
-    drive_item_id: str,
-) -> Optional[str]:
+    class_id: UUID,
+) -> Dict[str, str]:
     """
-    Return the stored ETag for a drive item, or None if it has never been
-    downloaded before.
+    Return {drive_item_id: etag} for every archived file of a class — one
+    indexed query, so a whole channel's skip decisions happen in memory.
     """
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT etag FROM archive WHERE drive_item_id = $1",
-            drive_item_id,
+        rows = await conn.fetch(
+            "SELECT drive_item_id, etag FROM archive WHERE class_id = $1",
+            class_id,
         )
-    return row["etag"] if row else None
+    return {r["drive_item_id"]: r["etag"] for r in rows}
 
 
-async def is_file_current(
+async def fetch_item_etags(
     pool: asyncpg.Pool,
-    drive_item_id: str,
-    current_etag: str,
-) -> bool:
+    drive_item_ids: List[str],
+) -> Dict[str, str]:
     """
-    Return True when the file is already on disk AND its etag hasn't changed
-    — i.e. we can safely skip it.
+    Return {drive_item_id: etag} for whichever of the given items are
+    archived, in one query — a page of files costs one round trip.
     """
-    stored = await get_archive_etag(pool, drive_item_id)
-    return stored is not None and stored == current_etag
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT drive_item_id, etag FROM archive WHERE drive_item_id = ANY($1::text[])",
+            drive_item_ids,
+        )
+    return {r["drive_item_id"]: r["etag"] for r in rows}
 
 
-async def upsert_archive(
+async def upsert_archive_many(
     pool: asyncpg.Pool,
-    *,
-    class_id: UUID,
-    file_name: str,
-    file_extension: str,
-    local_path: str,
-    drive_item_id: str,
-    etag: str,
-    s3_key: Optional[str] = None,
-) -> UUID:
-    """Insert or update an archive record after a successful download."""
+    rows: List[dict],
+) -> None:
+    """
+    Insert or update the archive record of every stored file in one
+    statement.
+
+    Each row is a dict of class_id, file_name, file_extension, local_path,
+    drive_item_id, etag and, optionally, s3_key. An s3_key of None keeps the
+    stored one (a 304 only refreshes the etag and name). Rows are
+    deduplicated by drive_item_id (last wins) since ON CONFLICT cannot
+    touch a row twice.
+    """
+    by_key = {r["drive_item_id"]: r for r in rows}
+    if not by_key:
+        return
+    cols = list(zip(*(
+        (r["class_id"], r["file_name"], r["file_extension"], r["local_path"],
+         r.get("s3_key"), key, r["etag"])
+        for key, r in by_key.items()
+    )))
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(
+        await conn.execute(
             """
             INSERT INTO archive
                 (class_id, file_name, file_extension, local_path, s3_key, drive_item_id, etag)
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            SELECT * FROM UNNEST(
+                $1::uuid[], $2::text[], $3::text[], $4::text[], $5::text[], $6::text[], $7::text[]
+            )
             ON CONFLICT (drive_item_id) DO UPDATE
                 SET file_name      = EXCLUDED.file_name,
                     file_extension = EXCLUDED.file_extension,
                     local_path     = EXCLUDED.local_path,
-                    s3_key         = EXCLUDED.s3_key,
+                    s3_key         = COALESCE(EXCLUDED.s3_key, archive.s3_key),
                     etag           = EXCLUDED.etag,
                     updated_at     = NOW()
-            RETURNING id
             """,
-            class_id, file_name, file_extension, local_path, s3_key, drive_item_id, etag,
+            *map(list, cols),
         )
-    return row["id"]
 
 
 # ─── Auth / Identity ───────────────────────────────────────────────────────────
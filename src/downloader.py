@@ -3,28 +3,52 @@ src/downloader.py — S3-direct file pipeline.
 
 Flow (S3-direct mode, no local disk writes)
 --------------------------------------------
-1. Check DB — if etag matches, skip entirely (S3 already has the file).
-2. Download file bytes from the Graph API.
-3. Upload bytes directly to S3.
-4. Write the s3_key to the archive table (local_path = NULL).
+1. Compare with the stored etag — if it matches, skip entirely (S3
+   already has the file). The caller looks stored etags up in bulk and
+   passes the item's in as `known_etag`; no per-file DB round trip.
+2. Stream the file from the Graph API, conditional on the stored etag
+   (If-None-Match) — a 304 means the stored copy is still current. Its
+   record is still queued with the listing's etag (and the current name),
+   keeping the stored s3_key, so the item stops looking changed.
+3. Feed the stream straight into an S3 (multipart) upload, so a file never
+   sits in memory whole, hashing it on the way — see storage.upload_stream.
+4. Queue the archive record (s3_key, local_path = NULL). Records are
+   written in bulk by flush() — every ARCHIVE_FLUSH_ROWS records or
+   ARCHIVE_FLUSH_INTERVAL seconds under run_flusher(), and once more at
+   the end of the run — so N files cost ⌈N/K⌉ DB round trips, not N.
+   A batch the DB rejects is split in halves until the offending rows
+   are isolated; those are logged and dropped, the rest written. A batch
+   that fails otherwise (e.g. the DB is unreachable) is re-queued, at most
+   ARCHIVE_FLUSH_ATTEMPTS times. A dropped record costs bandwidth, not
+   data: its etag was never stored, so the next run downloads it again.
 
 Returns
 -------
-"skip"  — file was already current in S3 and DB, nothing done
-"ok"    — file was downloaded and uploaded to S3 successfully
-"error" — something failed (logged); no DB record written
+"skip"  — file was already current in S3 (after a 304, its refreshed
+          etag is queued like an "ok" record)
+"ok"    — file is stored in S3 and its record queued; it reaches the DB
+          with the next flush() (see step 4)
+"error" — something failed (logged); no record queued
 
 S3 Key Scheme
 -------------
-  backup_teams/{team_name}/{channel_name}/{file_name}
+  backup_teams/{blake2b-128 hex of the content}.{extension}
 
-Derived from the local_path parameter, which is still passed in by the
-caller for key construction even though the file is never written to disk.
+Content-addressed: identical bytes share one object, so renames, moves and
+files posted to several channels are stored once. The file's name lives in
+the archive row; the API serves it as the download's filename.
+
+Settings
+--------
+Bucket and key prefix come from a frozen DownloaderSettings,
+read from the environment once at import. download_item() takes an explicit
+`settings` (tests pass their own); without one it uses that default.
 """
 import asyncio
 import logging
 import os
-from pathlib import Path
+from dataclasses import dataclass
+from typing import Optional
 from uuid import UUID
 
 import asyncpg
@@ -35,22 +59,136 @@ from src import storage
 
 log = logging.getLogger("backup_teams.downloader")
 
-_S3_BUCKET = os.environ.get("S3_BUCKET", "")
 
+@dataclass(frozen=True, slots=True)
+class DownloaderSettings:
+    """Downloader configuration, fixed for the life of the process."""
+    s3_bucket: str
+    prefix:    str = "backup_teams/"
 
-def _build_s3_key(local_path: Path) -> str:
-    """
-    Derive an S3 key from the intended local path.
+    @classmethod
+    def from_env(cls) -> "DownloaderSettings":
+        """S3_BUCKET, as set in the environment / .env."""
+        return cls(s3_bucket=os.environ.get("S3_BUCKET", ""))
+
+
+_SETTINGS = DownloaderSettings.from_env()
+
+ARCHIVE_FLUSH_ROWS     = int(os.getenv("ARCHIVE_FLUSH_ROWS", "100"))
+ARCHIVE_FLUSH_INTERVAL = float(os.getenv("ARCHIVE_FLUSH_INTERVAL", "0.25"))
+# Failed writes a record survives before it is dropped.
+ARCHIVE_FLUSH_ATTEMPTS = int(os.getenv("ARCHIVE_FLUSH_ATTEMPTS", "5"))
+
+# Errors caused by the rows themselves (e.g. a class_id that no longer
+# exists): retrying the same rows cannot succeed.
+_ROW_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+
+class _PendingUpserts:
+    """Archive records waiting for one db.upsert_archive_many() call."""
+
+    def __init__(self) -> None:
+        self._rows: dict = {}           # drive_item_id → row (last wins)
+        self._failures: dict = {}       # drive_item_id → failed writes so far
+        self.event = asyncio.Event()    # set once a batch is full
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, row: dict) -> None:
+        self._rows[row["drive_item_id"]] = row
+        if len(self._rows) >= ARCHIVE_FLUSH_ROWS:
+            self.event.set()
+
+    async def flush(self, pool: asyncpg.Pool) -> None:
+        rows, self._rows = list(self._rows.values()), {}
+        self.event.clear()
+        if not rows:
+            return
+        unwritten = {row["drive_item_id"]: row for row in rows}
+        try:
+            await self._write(pool, rows, unwritten)
+        except BaseException:
+            self._requeue(unwritten.values())
+            raise
+
+    async def _write(self, pool: asyncpg.Pool, rows: list, unwritten: dict) -> None:
+        """Write rows, halving the batch to isolate rows the DB rejects."""
+        try:
+            await db_mod.upsert_archive_many(pool, rows)
+        except _ROW_ERRORS as exc:
+            if len(rows) > 1:
+                mid = len(rows) // 2
+                await self._write(pool, rows[:mid], unwritten)
+                await self._write(pool, rows[mid:], unwritten)
+                return
+            log.error(
+                "Dropping archive record for %s (%s): %s",
+                rows[0]["file_name"], rows[0]["drive_item_id"], exc,
+            )
+        for row in rows:
+            unwritten.pop(row["drive_item_id"], None)
+            self._failures.pop(row["drive_item_id"], None)
 
-    The local path is never written to — it is used only as a structured
-    reference to carry team/channel/filename information from the scraper.
+    def _requeue(self, rows) -> None:
+        # Put unwritten rows back (newer records win) so a later flush —
+        # e.g. the final one after the flusher is cancelled — retries them.
+        for row in rows:
+            key      = row["drive_item_id"]
+            failures = self._failures.get(key, 0) + 1
+            if failures >= ARCHIVE_FLUSH_ATTEMPTS:
+                log.error("Dropping archive record for %s after %d failed writes", row["file_name"], failures)
+                self._failures.pop(key, None)
+                continue
+            self._failures[key] = failures
+            self._rows.setdefault(key, row)
+
+
+_pending = _PendingUpserts()
+
+
+async def flush(pool: asyncpg.Pool) -> None:
+    """Write every queued archive record now."""
+    await _pending.flush(pool)
+
+
+async def run_flusher(pool: asyncpg.Pool) -> None:
     """
-    download_root = Path(os.environ.get("DOWNLOAD_ROOT", "./downloads")).resolve()
-    try:
-        relative = local_path.resolve().relative_to(download_root)
-    except ValueError:
-        relative = Path(local_path.name)
-    return f"backup_teams/{relative}"
+    Background task: flush queued archive records whenever a batch fills
+    up, or every ARCHIVE_FLUSH_INTERVAL seconds. After a failed flush it
+    backs off instead, doubling the wait (up to 30s) until one succeeds. Runs until cancelled;
+    the caller does a final flush() afterwards.
+    """
+    backoff = 0.0
+    while True:
+        if backoff:
+            await asyncio.sleep(backoff)
+        else:
+            try:
+                await asyncio.wait_for(_pending.event.wait(), ARCHIVE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        try:
+            await _pending.flush(pool)
+        except Exception as exc:
+            # The batch was re-queued; records failing too often are dropped.
+            backoff = min((backoff or ARCHIVE_FLUSH_INTERVAL) * 2, 30.0)
+            log.error("Failed to record archived files (retrying in %.1fs): %s", backoff, exc)
+        else:
+            backoff = 0.0
+
+
+def _archive_row(class_id, file_name, extension, item_id, etag, s3_key) -> dict:
+    """An archive record for db.upsert_archive_many (s3_key None keeps the stored key)."""
+    return {
+        "class_id":       class_id,
+        "file_name":      file_name,
+        "file_extension": extension,
+        "local_path":     None,
+        "drive_item_id":  item_id,
+        "etag":           etag,
+        "s3_key":         s3_key,
+    }
 
 
 async def download_item(
@@ -60,54 +198,55 @@ async def download_item(
     drive_id: str,
     item: dict,
     class_id: UUID,
-    local_path: Path,
+    known_etag: Optional[str] = None,
+    settings: Optional[DownloaderSettings] = None,
 ) -> str:
     """
     Download a file from the Graph API and store it in S3.
 
     Returns "skip", "ok", or "error".
-    local_path is used ONLY for S3 key derivation, never written to.
+    known_etag is the etag archived for this item (None if never stored),
+    e.g. from db.fetch_item_etags(). settings defaults to the environment's.
     """
+    if settings is None:
+        settings = _SETTINGS
     item_id   = item["id"]
     etag      = item.get("eTag", item.get("id"))
     file_name = item["name"]
-    extension = Path(file_name).suffix.lstrip(".").lower() or "bin"
+    extension = os.path.splitext(file_name)[1].lstrip(".").lower() or "bin"
 
     # ── Step 1: Skip if up-to-date ────────────────────────────────────────────
-    if await db_mod.is_file_current(pool, item_id, etag):
+    if known_etag == etag:
         log.info("[SKIP] %s (etag matches — already in S3)", file_name)
         return "skip"
 
-    # ── Step 2: Download bytes from Graph API ─────────────────────────────────
-    log.info("[DL] %s …", file_name)
-    content = await graph.download_file(drive_id, item_id)
-    log.info("[OK] %-50s  (%d KB)", file_name, len(content) // 1024)
+    if not settings.s3_bucket:
+        log.warning("[S3] S3_BUCKET not configured — file %s not stored", file_name)
+        return "error"
 
-    # ── Step 3: Upload directly to S3 ─────────────────────────────────────────
-    s3_key = None
-    if _S3_BUCKET:
-        key = _build_s3_key(local_path)
+    # ── Steps 2+3: Stream from Graph API straight into S3 ─────────────────────
+    # Conditional on the stored etag, so a stale listing costs a 304 rather
+    # than the whole file.
+    log.info("[DL] %s …", file_name)
+    async with graph.stream_file(drive_id, item_id, if_none_match=known_etag) as chunks:
+        if chunks is None:
+            log.info("[SKIP] %s (304 — unchanged since last backup)", file_name)
+            _pending.add(_archive_row(class_id, file_name, extension, item_id, etag, None))
+            return "skip"
         try:
-            s3_key = await asyncio.to_thread(
-                storage.upload_file, _S3_BUCKET, key, content
+            s3_key = await storage.upload_stream(
+                settings.s3_bucket, chunks,
+                lambda digest: f"{settings.prefix}{digest}.{extension}",
             )
-            log.info("[S3] %-50s → s3://%s/%s", file_name, _S3_BUCKET, s3_key)
         except Exception as exc:
             log.warning("[S3] Upload failed for %s: %s", file_name, exc)
             return "error"
-    else:
-        log.warning("[S3] S3_BUCKET not configured — file %s not stored", file_name)
-        return "error"
-
-    # ── Step 4: Persist record to DB ──────────────────────────────────────────
-    await db_mod.upsert_archive(
-        pool,
-        class_id=class_id,
-        file_name=file_name,
-        file_extension=extension,
-        local_path=None,
-        drive_item_id=item_id,
-        etag=etag,
-        s3_key=s3_key,
-    )
+        log.info("[S3] %-50s → s3://%s/%s", file_name, settings.s3_bucket, s3_key)
+
+        # ── Step 4: Queue record for the next bulk DB write ───────────────────
+        # Queued before the Graph response is closed: there is no await
+        # between the object landing in S3 and its record being queued, so
+        # a cancellation cannot leave an object the archive doesn't know.
+        # Queued records survive cancellation — flush() re-queues on failure.
+        _pending.add(_archive_row(class_id, file_name, extension, item_id, etag, s3_key))
     return "ok"
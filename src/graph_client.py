@@ -6,26 +6,186 @@ Responsibilities
 - Hold the Bearer token and attach it to every request.
 - Provide one method per Graph endpoint we need.
 - Handle HTTP 429 (rate limit) with exponential back-off (up to 5 retries).
-- Raise clear errors on 401 (token expired) so the caller can re-auth.
+- On 401 (token expired), refresh the token once through the injected
+  token_provider — shared by all concurrent requests — and retry. Without
+  a provider, raise a clear error so the caller can re-auth.
+- Coalesce identical concurrent GETs into one request (single-flight) and
+  keep single-object responses for a short TTL so sibling tasks and
+  re-scrapes don't re-fetch the same team/drive metadata.
+- Fan per-team / per-channel metadata lookups out through JSON batching
+  (/$batch, 20 sub-requests per POST) so N lookups cost one round trip.
+- Pace every request (downloads and /$batch sub-requests included) through
+  a token bucket at GRAPH_RPS; a 429's Retry-After drains and pauses it.
+- Retry transient 502/503/504 answers with back-off (without throttling).
+- Surface HTTP failures as typed GraphHTTPError subclasses (GraphForbidden,
+  GraphNotFound, GraphRateLimited, GraphUnavailable) carrying status and
+  Retry-After, so callers branch on type instead of parsing exception
+  messages.
 """
 import asyncio
 import logging
-from typing import Any, Optional, List
+import os
+import time
+from contextlib import asynccontextmanager, nullcontext, suppress
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, List, Tuple
 
 import httpx
+import orjson
+
+from src.ratelimit import TokenBucket
 
 log = logging.getLogger("backup_teams.graph")
 
 BASE_URL = "https://graph.microsoft.com/v1.0"
 MAX_RETRIES = 5
+RETRY_DELAY = 2.0    # first back-off (seconds) when the server gives no Retry-After
+CACHE_TTL      = 300    # seconds a completed single-object GET stays cached
+CACHE_MAXSIZE  = 4096
+BATCH_LIMIT    = 20     # hard Graph limit on sub-requests per /$batch POST
+
+# Outbound request pacing (requests/second and burst size). The burst must
+# cover one full /$batch POST, which costs a token per sub-request.
+GRAPH_RPS   = float(os.getenv("GRAPH_RPS", "25"))
+GRAPH_BURST = max(BATCH_LIMIT, int(os.getenv("GRAPH_BURST", "40")))
+
+# Graph and SharePoint both speak HTTP/2, so the gather() fan-outs multiplex
+# as streams over a handful of connections; the pool caps only matter for
+# hosts that fall back to HTTP/1.1. Idle connections are kept for 5 minutes
+# so the run pays TCP/TLS setup (and DNS) once per host, not per burst.
+HTTP_LIMITS = httpx.Limits(
+    max_connections=64,
+    max_keepalive_connections=32,
+    keepalive_expiry=300,
+)
+# Fail fast on unreachable hosts, but give large downloads a generous
+# per-read window. Our limiters normally keep requests below the pool size;
+# the pool timeout is a backstop so a request holding a Vegas slot can never
+# wait forever for a connection.
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0, pool=30.0)
+
+# Read size for stream_file(): what a download holds in memory at a time.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Owners only, with just the fields professor detection reads.
+_OWNERS_EXPAND = (
+    "members($filter=roles/any(r:r eq 'owner');$select=displayName,email,userId,roles)"
+)
+
+_JSON_CONTENT = {"Content-Type": "application/json"}
+
+
+def _noop() -> None:
+    """Stands in for the limiter's success callback when no limiter is set."""
+
+
+# Drive fields site-id resolution reads (see teams_scraper._get_site_id_for_team).
+_DRIVE_SELECT = "id,parentReference,sharePointIds,webUrl"
+
+# Only the fields the walker and downloader read; 200 is the page-size cap.
+_CHILDREN_QUERY = "$top=200&$select=id,name,file,folder,size,eTag"
+
+
+# ─── Errors ────────────────────────────────────────────────────────────────────
+
+class GraphHTTPError(httpx.HTTPStatusError):
+    """
+    Non-2xx answer from Graph. Subclasses httpx.HTTPStatusError so handlers
+    written against httpx keep working.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        *,
+        request: httpx.Request,
+        response: httpx.Response,
+        retry_after: Optional[float] = None,
+    ) -> None:
+        super().__init__(message, request=request, response=response)
+        self.status      = response.status_code
+        self.retry_after = retry_after
+
+
+class GraphForbidden(GraphHTTPError):
+    """403 — e.g. channel listing denied to students in Education tenants."""
+
+
+class GraphNotFound(GraphHTTPError):
+    """404 — e.g. /teams/{id}/drive on non-standard SharePoint provisioning."""
+
+
+class GraphRateLimited(GraphHTTPError):
+    """429 that outlasted our retries; retry_after says how long to wait."""
+
+
+class GraphUnavailable(GraphHTTPError):
+    """502 / 503 / 504 that outlasted our retries — a transient server fault."""
+
+
+_ERRORS_BY_STATUS = {
+    403: GraphForbidden,
+    404: GraphNotFound,
+    429: GraphRateLimited,
+    502: GraphUnavailable,
+    503: GraphUnavailable,
+    504: GraphUnavailable,
+}
+
+# Gateway / availability faults worth retrying. Unlike 429 they are not a
+# rate signal, so they back off without throttling the limiters.
+_TRANSIENT_STATUSES = frozenset({502, 503, 504})
+
+
+def _graph_error(response: httpx.Response, message: Optional[str] = None) -> GraphHTTPError:
+    """Build the typed error for `response`, worded like raise_for_status()."""
+    status = response.status_code
+    if message is None:
+        kind = "Client error" if status < 500 else "Server error"
+        message = f"{kind} '{status} {response.reason_phrase}' for url '{response.request.url}'"
+    return _ERRORS_BY_STATUS.get(status, GraphHTTPError)(
+        message,
+        request=response.request,
+        response=response,
+        retry_after=_retry_after(response.headers, None),
+    )
+
+
+def _retry_after(headers, default: Optional[float]) -> Optional[float]:
+    """
+    Seconds to back off after a 429: Retry-After, else the draft-standard
+    RateLimit-Reset (SharePoint sends it alongside RateLimit-Remaining),
+    else `default`.
+    """
+    for name in ("Retry-After", "RateLimit-Reset"):
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    return default
 
 
 class GraphClient:
     """Thin async wrapper around the Microsoft Graph REST API."""
 
-    def __init__(self, token: str) -> None:
+    def __init__(
+        self,
+        token: str,
+        token_provider: Optional[Callable[[], Awaitable[Optional[str]]]] = None,
+    ) -> None:
         self._token = token
+        self._token_provider = token_provider
+        self._token_version  = 0
+        self._refresh_lock   = asyncio.Lock()
         self._client: Optional[httpx.AsyncClient] = None
+        self._bucket = TokenBucket(GRAPH_RPS, GRAPH_BURST)
+        self._throttle_listeners: List[Callable[[float], Awaitable[None]]] = [
+            self._bucket.throttle,
+        ]
+        self._limiter = None
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._cache: Dict[Tuple, Tuple[float, Any]] = {}
 
     # ─── Context manager ──────────────────────────────────────────────────────
 
@@ -36,8 +196,9 @@ class GraphClient:
                 "Authorization": f"Bearer {self._token}",
                 "Accept": "application/json",
             },
-            timeout=60.0,
+            timeout=HTTP_TIMEOUT,
             http2=True,
+            limits=HTTP_LIMITS,
         )
         return self
 
@@ -45,49 +206,140 @@ class GraphClient:
         if self._client:
             await self._client.aclose()
 
-    # ─── Internal request helper ──────────────────────────────────────────────
+    # ─── Back-pressure hooks ──────────────────────────────────────────────────
 
-    async def _get(self, url: str, **params) -> Any:
+    def add_throttle_listener(self, callback: Callable[[float], Awaitable[None]]) -> None:
+        """Register `await callback(retry_after)` to run on every 429 we receive."""
+        self._throttle_listeners.append(callback)
+
+    def set_limiter(self, limiter) -> None:
+        """
+        Gate every Graph API request through `limiter.use(method)` (e.g. a
+        ratelimit.VegasLimiter), reporting 2xx responses back to it. The
+        method keys its latency baseline: every POST is a /$batch, far
+        slower than a single GET. File downloads are not gated: their
+        latency tracks file size, not server load.
         """
-        GET `url` (absolute or relative to BASE_URL) with automatic retry on
-        429 and connection errors.
+        self._limiter = limiter
+
+    async def _throttled(self, retry_after: float) -> None:
+        for callback in self._throttle_listeners:
+            await callback(retry_after)
+
+    # ─── Internal request helpers ─────────────────────────────────────────────
+
+    async def _get(self, url: str, cache: bool = True, **params) -> Any:
+        """
+        GET `url`, sharing the request with any concurrent caller asking for
+        the same URL + params. Successful responses are kept for CACHE_TTL
+        seconds unless cache=False (used for paged listings, which are large
+        and rarely re-requested).
+
+        The fetch runs as its own task and callers await it through
+        asyncio.shield, so cancelling one caller never cancels the request
+        the others are waiting on. Returned objects are shared — don't mutate.
+        """
+        key = (url, tuple(sorted(params.items())))
+
+        hit = self._cache.get(key)
+        if hit is not None:
+            if hit[0] > time.monotonic():
+                return hit[1]
+            del self._cache[key]
+
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._request("GET", url, params=params))
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f: self._settle(key, f, cache))
+        return await asyncio.shield(fut)
+
+    def _settle(self, key: Tuple, fut: asyncio.Future, cache: bool) -> None:
+        """Done-callback for a single-flight fetch: unregister and maybe cache."""
+        self._inflight.pop(key, None)
+        if not cache or fut.cancelled() or fut.exception() is not None:
+            return
+        if len(self._cache) >= CACHE_MAXSIZE:
+            # dicts keep insertion order — drop the oldest entry
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[key] = (time.monotonic() + CACHE_TTL, fut.result())
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Optional[dict] = None,
+        json: Any = None,
+        cost: int = 1,
+    ) -> Any:
+        """
+        Send `method url` (absolute or relative to BASE_URL) with automatic
+        retry on 429, 502/503/504 and connection errors; return the decoded
+        JSON body. Each attempt first takes `cost` tokens from the rate
+        bucket (the sub-request count for a /$batch POST).
 
         Raises:
-            httpx.HTTPStatusError  — on 401 (token expired, caught by caller)
-            RuntimeError           — after MAX_RETRIES exhausted
+            GraphHTTPError    — on any non-2xx status (401 only once a token
+                                refresh didn't fix it; typed subclasses for
+                                403 / 404 and for 429 / 5xx after retries)
+            RuntimeError      — network errors persisted for MAX_RETRIES
         """
         assert self._client, "GraphClient must be used as an async context manager."
-        delay = 2.0
+        # Encoded once (with orjson, like responses) and reused across retries.
+        body = orjson.dumps(json) if json is not None else None
+        delay = RETRY_DELAY
+        refreshed = False
+        retried: Optional[httpx.Response] = None
 
         for attempt in range(1, MAX_RETRIES + 1):
+            version = self._token_version
+            await self._bucket.acquire(cost)
             try:
-                resp = await self._client.get(url, params=params or None)
-            except (httpx.ConnectError, httpx.ReadTimeout) as exc:
+                async with self._limiter.use(method) if self._limiter else nullcontext(_noop) as succeeded:
+                    resp = await self._client.request(
+                        method, url, params=params or None,
+                        content=body, headers=_JSON_CONTENT if body is not None else None,
+                    )
+                    if resp.is_success:
+                        succeeded()
+            except (httpx.ConnectError, httpx.ReadTimeout, httpx.PoolTimeout) as exc:
                 log.warning("Network error (attempt %d/%d): %s", attempt, MAX_RETRIES, exc)
                 await asyncio.sleep(delay)
                 delay *= 2
                 continue
 
             if resp.status_code == 429:
-                retry_after = int(resp.headers.get("Retry-After", delay))
-                log.warning("Rate-limited — waiting %ds (attempt %d/%d)", retry_after, attempt, MAX_RETRIES)
+                retried     = resp
+                retry_after = _retry_after(resp.headers, delay)
+                log.warning("Rate-limited — waiting %gs (attempt %d/%d)", retry_after, attempt, MAX_RETRIES)
+                await self._throttled(retry_after)
                 await asyncio.sleep(retry_after)
                 delay = max(delay * 2, retry_after)
                 continue
 
-            if resp.status_code == 401:
-                raise httpx.HTTPStatusError(
-                    "Bearer token expired (401). Re-auth required.",
-                    request=resp.request,
-                    response=resp,
+            if resp.status_code in _TRANSIENT_STATUSES:
+                retried     = resp
+                retry_after = _retry_after(resp.headers, delay)
+                log.warning(
+                    "Graph unavailable (%d) — retrying in %gs (attempt %d/%d)",
+                    resp.status_code, retry_after, attempt, MAX_RETRIES,
                 )
+                await asyncio.sleep(retry_after)
+                delay = max(delay * 2, retry_after)
+                continue
+
+            if resp.status_code == 401:
+                if not refreshed and await self._refresh_token(version):
+                    refreshed = True
+                    continue
+                raise _graph_error(resp, "Bearer token expired (401). Re-auth required.")
 
             if resp.status_code == 403:
                 # Log the full error body — Microsoft includes an error code and
                 # message that explains exactly why access was denied.
                 try:
-                    body = resp.json()
-                    err  = body.get("error", {})
+                    err = orjson.loads(resp.content).get("error", {})
                     log.debug(
                         "403 body for %s: code=%r message=%r",
                         url, err.get("code"), err.get("message"),
@@ -95,54 +347,264 @@ class GraphClient:
                 except Exception:
                     pass
 
-            resp.raise_for_status()
-            return resp.json()
+            if resp.is_error:
+                raise _graph_error(resp)
+            # orjson decodes large listing pages 2–3x faster than stdlib json
+            return orjson.loads(resp.content)
 
+        if retried is not None:
+            raise _graph_error(retried)
         raise RuntimeError(f"Graph API request to {url!r} failed after {MAX_RETRIES} retries.")
 
+    # ─── Token refresh ────────────────────────────────────────────────────────
+
+    async def _refresh_token(self, seen_version: int) -> bool:
+        """
+        Replace the Bearer token after a 401 seen while using `seen_version`.
+
+        All concurrent requests that hit the same expiry queue on one lock:
+        the first one fetches a new token, the rest see the bumped version
+        and simply retry with it. Returns False when no provider is set or
+        it could not produce a token.
+        """
+        if self._token_provider is None:
+            return False
+        async with self._refresh_lock:
+            if self._token_version == seen_version:
+                log.warning("Bearer token rejected (401) — refreshing…")
+                try:
+                    token = await self._token_provider()
+                except Exception as exc:
+                    log.error("Token refresh failed: %s", exc)
+                    return False
+                if not token:
+                    return False
+                self._token = token
+                self._client.headers["Authorization"] = f"Bearer {token}"
+                self._token_version += 1
+        return True
+
     # ─── Paging helper ────────────────────────────────────────────────────────
 
     async def _get_all(self, url: str, **params) -> List[dict]:
         """Follow @odata.nextLink pages and return all items concatenated."""
-        results = []
-        next_url: Optional[str] = url
+        return await self._follow_pages(await self._get(url, cache=False, **params))
+
+    async def _follow_pages(self, first_page: dict) -> List[dict]:
+        """Concatenate `first_page` with every page reachable via @odata.nextLink."""
+        results = list(first_page.get("value", []))
+        next_url: Optional[str] = first_page.get("@odata.nextLink")
         while next_url:
-            data = await self._get(next_url, **(params if next_url == url else {}))
+            data = await self._get(next_url, cache=False)
             results.extend(data.get("value", []))
             next_url = data.get("@odata.nextLink")
         return results
 
+    # ─── JSON batching ────────────────────────────────────────────────────────
+
+    async def _batch_get(self, urls: Dict[str, str]) -> Dict[str, Any]:
+        """
+        GET several relative URLs through /$batch, BATCH_LIMIT per POST, with
+        all POSTs in flight concurrently.
+
+        `urls` maps a caller-chosen id to a URL relative to BASE_URL. Returns
+        the same ids mapped to either the decoded body or the exception for
+        that sub-request (GraphHTTPError for non-2xx statuses), so one
+        failing lookup never sinks its siblings. Sub-requests answered with
+        429 or 502/503/504, or missing from the reply, are re-batched after
+        the largest Retry-After; only 429s throttle the limiters.
+        """
+        results: Dict[str, Any] = {}
+        pending = dict(urls)
+        delay = RETRY_DELAY
+
+        for attempt in range(1, MAX_RETRIES + 1):
+            ids    = list(pending)
+            chunks = [ids[i:i + BATCH_LIMIT] for i in range(0, len(ids), BATCH_LIMIT)]
+            payloads = await asyncio.gather(
+                *[
+                    self._request("POST", "/$batch", json={
+                        "requests": [
+                            {"id": sid, "method": "GET", "url": pending[sid]}
+                            for sid in chunk
+                        ],
+                    }, cost=len(chunk))
+                    for chunk in chunks
+                ],
+                return_exceptions=True,
+            )
+
+            retry_after = 0.0
+            throttled   = False
+            last_retry: Dict[str, Tuple[int, dict]] = {}
+            for chunk, payload in zip(chunks, payloads):
+                if isinstance(payload, Exception):
+                    for sid in chunk:
+                        results[sid] = payload
+                        del pending[sid]
+                    continue
+                for sub in payload.get("responses", []):
+                    sid    = sub.get("id")
+                    if sid not in pending:
+                        continue            # unknown or duplicate id
+                    status = sub.get("status", 500)
+                    headers = sub.get("headers") or {}
+                    if status == 429 or status in _TRANSIENT_STATUSES:
+                        retry_after = max(retry_after, _retry_after(headers, delay))
+                        throttled   = throttled or status == 429
+                        last_retry[sid] = (status, headers)
+                        continue
+                    url = pending.pop(sid)
+                    body = sub.get("body")
+                    results[sid] = body if status < 400 else self._batch_error(url, status, body, headers)
+                # Graph occasionally leaves a sub-response out of the reply;
+                # those ids are retried like a 503.
+                for sid in chunk:
+                    if sid in pending and sid not in last_retry:
+                        retry_after = max(retry_after, delay)
+                        last_retry[sid] = (503, {})
+
+            if not pending:
+                return results
+
+            log.warning(
+                "%s in batch — %d sub-requests waiting %gs (attempt %d/%d)",
+                "Rate-limited" if throttled else "Server unavailable",
+                len(pending), retry_after, attempt, MAX_RETRIES,
+            )
+            if throttled:
+                await self._throttled(retry_after)
+            await asyncio.sleep(retry_after)
+            delay = max(delay * 2, retry_after)
+
+        for sid, url in pending.items():
+            status, headers = last_retry[sid]
+            results[sid] = self._batch_error(url, status, None, headers)
+        return results
+
+    @staticmethod
+    def _batch_error(url: str, status: int, body: Any, headers: dict) -> GraphHTTPError:
+        """Build the same typed error a direct call to `url` would raise."""
+        err = (body or {}).get("error", {}) if isinstance(body, dict) else {}
+        if status == 403:
+            log.debug(
+                "403 body for %s: code=%r message=%r",
+                url, err.get("code"), err.get("message"),
+            )
+        request = httpx.Request("GET", f"{BASE_URL}{url}")
+        return _graph_error(httpx.Response(status, headers=headers, request=request))
+
     # ─── Public Graph methods ─────────────────────────────────────────────────
 
     async def list_joined_teams(self) -> List[dict]:
-        """Return all Teams the authenticated user is a member of."""
-        return await self._get_all("/me/joinedTeams")
-
-    async def list_channels(self, team_id: str) -> List[dict]:
-        """Return all channels for the given team."""
-        return await self._get_all(f"/teams/{team_id}/channels")
+        """
+        Return all Teams the authenticated user is a member of.
 
-    async def get_primary_channel(self, team_id: str) -> dict:
+        Owners are requested inline via $expand=members, so each team dict
+        normally carries a `members` list and no per-team member lookup is
+        needed. Tenants that reject the expansion (400) get the plain
+        listing; callers must treat `members` as optional.
         """
-        Return the primary (General) channel for a team.
+        try:
+            return await self._get_all("/me/joinedTeams", **{"$expand": _OWNERS_EXPAND})
+        except GraphHTTPError as exc:
+            if exc.status != 400:
+                raise
+            log.debug("joinedTeams rejected $expand=members — listing without it")
+            return await self._get_all("/me/joinedTeams")
+
+    async def get_team_overview(
+        self,
+        team_id: str,
+        include_members: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        Fetch a team's members, channel list, primary channel and group
+        drive in a single /$batch round trip. Pass include_members=False
+        when the members already came expanded from list_joined_teams().
+
+        Returns {"members": ..., "channels": ..., "primary": ..., "drive": ...}
+        where each value is the result (lists fully paged) or the exception
+        raised for that lookup. The primary channel rides along because
+        Education tenants 403 on the channel list for students, and it is
+        the fallback; the group drive lets SharePoint site resolution start
+        without waiting on the channel pass.
+        """
+        urls = {
+            "channels": f"/teams/{team_id}/channels",
+            "primary":  f"/teams/{team_id}/primaryChannel",
+            "drive":    f"/groups/{team_id}/drive?$select={_DRIVE_SELECT}",
+        }
+        if include_members:
+            urls["members"] = f"/teams/{team_id}/members"
+        overview = await self._batch_get(urls)
+        for key in ("members", "channels"):
+            if key in overview and not isinstance(overview[key], Exception):
+                try:
+                    overview[key] = await self._follow_pages(overview[key])
+                except Exception as exc:
+                    overview[key] = exc
+        return overview
 
-        Used as a fallback when /teams/{id}/channels returns 403 —
-        which happens in Education tenants where the channels list
-        endpoint is restricted for student-role members even when they
-        can see the team. The primary channel is always accessible.
+    async def get_files_folders(self, team_id: str, channel_ids: List[str]) -> Dict[str, Any]:
+        """
+        Map each channel id to its root DriveItem (carrying
+        `parentReference.driveId` and `id`), or to the exception raised for
+        that channel — all channels in one batch round trip.
         """
-        return await self._get(f"/teams/{team_id}/primaryChannel")
+        results = await self._batch_get({
+            str(i): f"/teams/{team_id}/channels/{channel_id}/filesFolder"
+            for i, channel_id in enumerate(channel_ids)
+        })
+        return {channel_id: results[str(i)] for i, channel_id in enumerate(channel_ids)}
+
+    async def iter_drive_pages(
+        self,
+        drive_id: str,
+        item_id: Optional[str] = None,
+        *,
+        next_link: Optional[str] = None,
+    ) -> AsyncIterator[List[dict]]:
+        """
+        Yield a folder's children one page (list) at a time, starting from
+        the folder's first page (`item_id`) or from a known `next_link`.
 
-    async def get_files_folder(self, team_id: str, channel_id: str) -> dict:
+        Page N+1 is requested as soon as page N lands, so the request is in
+        flight while the caller is still consuming page N.
         """
-        Return the root DriveItem for a channel's file library.
-        The response contains `parentReference.driveId` and `id`.
+        url = next_link or f"/drives/{drive_id}/items/{item_id}/children?{_CHILDREN_QUERY}"
+        pending: Optional[asyncio.Future] = asyncio.ensure_future(self._get(url, cache=False))
+        try:
+            while pending is not None:
+                page = await pending
+                url  = page.get("@odata.nextLink")
+                pending = asyncio.ensure_future(self._get(url, cache=False)) if url else None
+                yield page.get("value", [])
+        finally:
+            if pending is not None:
+                pending.cancel()
+                # Collect the outcome, so a prefetch that had already failed
+                # is not reported as "Task exception was never retrieved".
+                with suppress(asyncio.CancelledError, Exception):
+                    await pending
+
+    async def list_children_pages(self, drive_id: str, cursors: List[str]) -> List[Any]:
         """
-        return await self._get(f"/teams/{team_id}/channels/{channel_id}/filesFolder")
+        Fetch one page of children for each cursor in a single batch round trip.
 
-    async def list_drive_children(self, drive_id: str, item_id: str) -> List[dict]:
-        """List direct children of a drive item (folder contents)."""
-        return await self._get_all(f"/drives/{drive_id}/items/{item_id}/children")
+        A cursor is either a folder's item id (first page) or the
+        @odata.nextLink of a previous page. Returns, in cursor order, each
+        page dict (`value` + optional `@odata.nextLink`) or the exception
+        raised for that folder.
+        """
+        urls = {}
+        for i, cursor in enumerate(cursors):
+            if cursor.startswith(BASE_URL):
+                urls[str(i)] = cursor[len(BASE_URL):]
+            else:
+                urls[str(i)] = f"/drives/{drive_id}/items/{cursor}/children?{_CHILDREN_QUERY}"
+        results = await self._batch_get(urls)
+        return [results[str(i)] for i in range(len(cursors))]
 
     async def get_team_drive(self, team_id: str) -> dict:
         """
@@ -150,7 +612,7 @@ class GraphClient:
         Returns 404 when the institution uses non-standard SharePoint provisioning.
         In that case, use get_group_drive() as a fallback.
         """
-        return await self._get(f"/teams/{team_id}/drive")
+        return await self._get(f"/teams/{team_id}/drive", **{"$select": _DRIVE_SELECT})
 
     async def get_group_drive(self, group_id: str) -> dict:
         """
@@ -158,13 +620,19 @@ class GraphClient:
         Fallback when /teams/{id}/drive returns 404 — the /groups path has different
         routing logic and often succeeds where /teams fails.
         """
-        return await self._get(f"/groups/{group_id}/drive")
+        return await self._get(f"/groups/{group_id}/drive", **{"$select": _DRIVE_SELECT})
 
     async def list_site_drives(self, site_id: str) -> List[dict]:
         """
         Return all document libraries (drives) on a SharePoint site.
+
+        Each drive carries its root item id under drive["root"]["id"]
+        ($expand=root), so walking a library needs no get_drive_root() call.
         """
-        return await self._get_all(f"/sites/{site_id}/drives")
+        return await self._get_all(
+            f"/sites/{site_id}/drives",
+            **{"$select": "id,name,root", "$expand": "root($select=id)"},
+        )
 
     async def get_site_by_url(self, hostname: str, site_path: str) -> dict:
         """
@@ -182,46 +650,91 @@ class GraphClient:
         """Return the root DriveItem of a drive (starting point for walking)."""
         return await self._get(f"/drives/{drive_id}/root")
 
-    async def get_team_members(self, team_id: str) -> List[dict]:
-        """
-        Return membership of a team. Members with roles=["owner"] are owners
-        (usually the professor in an education tenant).
-        """
-        return await self._get_all(f"/teams/{team_id}/members")
-
-    async def download_file(self, drive_id: str, item_id: str) -> bytes:
+    @asynccontextmanager
+    async def stream_file(
+        self,
+        drive_id: str,
+        item_id: str,
+        if_none_match: Optional[str] = None,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    ) -> AsyncIterator[Optional[AsyncIterator[bytes]]]:
         """
-        Stream-download a file and return its raw bytes.
+        Open a file download and yield an async iterator over its bytes in
+        `chunk_size` pieces, so callers can pass the body on (e.g. to S3)
+        without holding the whole file. The response is closed on exit.
         Follows the redirect that Graph returns for /content.
+
+        With `if_none_match` (a previously stored eTag) the request is
+        conditional: if the file still matches it Graph answers 304 with no
+        body and this yields None. The caller should then store the item's
+        current eTag, or every later run repeats the same conditional GET.
+
+            async with graph.stream_file(drive_id, item_id) as chunks:
+                async for chunk in chunks: ...
         """
         assert self._client
-        delay = 2.0
+        delay = RETRY_DELAY
         url = f"/drives/{drive_id}/items/{item_id}/content"
+        headers = {"If-None-Match": if_none_match} if if_none_match else None
+        refreshed = False
+        retried: Optional[httpx.Response] = None
 
         for attempt in range(1, MAX_RETRIES + 1):
+            version = self._token_version
+            await self._bucket.acquire()
             try:
-                resp = await self._client.get(url, follow_redirects=True)
-            except (httpx.ConnectError, httpx.ReadTimeout) as exc:
+                resp = await self._client.send(
+                    self._client.build_request("GET", url, headers=headers),
+                    stream=True,
+                    follow_redirects=True,
+                )
+            except (httpx.ConnectError, httpx.ReadTimeout, httpx.PoolTimeout) as exc:
                 log.warning("Download error (attempt %d/%d): %s", attempt, MAX_RETRIES, exc)
                 await asyncio.sleep(delay)
                 delay *= 2
                 continue
 
             if resp.status_code == 429:
-                retry_after = int(resp.headers.get("Retry-After", delay))
-                log.warning("Rate-limited on download — waiting %ds", retry_after)
+                await resp.aclose()
+                retried     = resp
+                retry_after = _retry_after(resp.headers, delay)
+                log.warning("Rate-limited on download — waiting %gs", retry_after)
+                await self._throttled(retry_after)
+                await asyncio.sleep(retry_after)
+                delay = max(delay * 2, retry_after)
+                continue
+
+            if resp.status_code in _TRANSIENT_STATUSES:
+                await resp.aclose()
+                retried     = resp
+                retry_after = _retry_after(resp.headers, delay)
+                log.warning("Download unavailable (%d) — retrying in %gs", resp.status_code, retry_after)
                 await asyncio.sleep(retry_after)
                 delay = max(delay * 2, retry_after)
                 continue
 
             if resp.status_code == 401:
-                raise httpx.HTTPStatusError(
-                    "Bearer token expired during download.",
-                    request=resp.request,
-                    response=resp,
-                )
+                await resp.aread()
+                if not refreshed and await self._refresh_token(version):
+                    refreshed = True
+                    continue
+                raise _graph_error(resp, "Bearer token expired during download.")
 
-            resp.raise_for_status()
-            return resp.content
+            if resp.status_code == 304:
+                await resp.aclose()
+                yield None
+                return
+
+            if resp.is_error:
+                await resp.aread()
+                raise _graph_error(resp)
+
+            try:
+                yield resp.aiter_bytes(chunk_size)
+            finally:
+                await resp.aclose()
+            return
 
+        if retried is not None:
+            raise _graph_error(retried)
         raise RuntimeError(f"File download failed after {MAX_RETRIES} retries (item {item_id}).")
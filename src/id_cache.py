@@ -0,0 +1,219 @@
+"""
+src/id_cache.py — Memoised curso / class / professor upserts.
+
+Every run re-upserts the same teams, channels and owners, and each upsert
+is a DB round trip. These wrappers remember the row id returned for each
+natural key together with the values that were written; a repeat call with
+identical values returns the remembered id without touching the DB, while
+a changed value (e.g. a renamed channel) still goes through the upsert.
+
+It also remembers each team's SharePoint library names, so teams whose
+site holds nothing but the default library can skip the site drives pass
+until SITE_DRIVES_TTL expires.
+
+The cache is persisted to ID_CACHE_PATH (default
+~/.cache/backup_teams/ids.json) so warm starts skip the upserts entirely.
+The file records which database it belongs to and is ignored when pointed
+at a different one. verify() then drops remembered ids whose rows no
+longer exist (a database reset in place, deleted rows), so they are
+upserted afresh instead of being handed out as dangling foreign keys.
+"""
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+import asyncpg
+import orjson
+
+from src import db as db_mod
+
+log = logging.getLogger("backup_teams.id_cache")
+
+CACHE_PATH = Path(
+    os.getenv("ID_CACHE_PATH", "~/.cache/backup_teams/ids.json")
+).expanduser()
+# Seconds a team's remembered library names stay trusted (default 7 days).
+SITE_DRIVES_TTL = float(os.getenv("SITE_DRIVES_TTL", str(7 * 24 * 3600)))
+
+# natural key → (values written, row id)
+_cursos:     Dict[str, Tuple[list, str]] = {}   # teams_id
+_classes:    Dict[str, Tuple[list, str]] = {}   # teams_channel_id
+_professors: Dict[str, Tuple[list, str]] = {}   # email
+
+# teams_id → (site library names, unix time they were listed)
+_site_drives: Dict[str, Tuple[list, float]] = {}
+
+
+def _db_identity() -> str:
+    return (
+        f"{os.environ.get('DB_HOST', 'localhost')}:{os.environ.get('DB_PORT', '5432')}"
+        f"/{os.environ.get('DB_NAME', '')}"
+    )
+
+
+# ─── Persistence ───────────────────────────────────────────────────────────────
+
+def load() -> None:
+    """Populate the in-memory caches from CACHE_PATH, if it matches this DB."""
+    try:
+        data = orjson.loads(CACHE_PATH.read_bytes())
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as exc:
+        log.warning("Ignoring unreadable id cache %s: %s", CACHE_PATH, exc)
+        return
+
+    if data.get("db") != _db_identity():
+        log.info("Id cache %s belongs to another database — ignoring it.", CACHE_PATH)
+        return
+
+    for name, cache in (
+        ("cursos", _cursos), ("classes", _classes),
+        ("professors", _professors), ("site_drives", _site_drives),
+    ):
+        cache.update({k: (v[0], v[1]) for k, v in data.get(name, {}).items()})
+    log.debug(
+        "Loaded id cache: %d cursos, %d classes, %d professors",
+        len(_cursos), len(_classes), len(_professors),
+    )
+
+
+def save() -> None:
+    """Write the in-memory caches to CACHE_PATH (best effort)."""
+    data = {
+        "db":         _db_identity(),
+        "cursos":     _cursos,
+        "classes":    _classes,
+        "professors": _professors,
+        "site_drives": _site_drives,
+    }
+    try:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = CACHE_PATH.with_suffix(".tmp")
+        tmp.write_bytes(orjson.dumps(data))
+        tmp.replace(CACHE_PATH)
+    except OSError as exc:
+        log.warning("Could not save id cache to %s: %s", CACHE_PATH, exc)
+
+
+async def verify(pool: asyncpg.Pool) -> None:
+    """
+    Forget remembered ids that no longer exist in the database — one query
+    per table. If the check itself fails, the whole cache is dropped.
+    """
+    try:
+        for table, cache in (
+            ("professor", _professors), ("curso", _cursos), ("class", _classes),
+        ):
+            if not cache:
+                continue
+            present = await db_mod.fetch_existing_ids(pool, table, [v[1] for v in cache.values()])
+            stale = [key for key, (_, row_id) in cache.items() if row_id not in present]
+            for key in stale:
+                del cache[key]
+            if stale:
+                log.info("Id cache: %d %s ids no longer in the database — forgotten.", len(stale), table)
+    except Exception as exc:
+        log.warning("Could not verify id cache, ignoring it: %s", exc)
+        for cache in (_cursos, _classes, _professors):
+            cache.clear()
+
+
+def _lookup(cache: Dict[str, Tuple[list, str]], key: str, values: list) -> Optional[UUID]:
+    hit = cache.get(key)
+    if hit is not None and hit[0] == values:
+        return UUID(hit[1])
+    return None
+
+
+# ─── Site library names ────────────────────────────────────────────────────────
+
+def site_drive_names(teams_id: str) -> Optional[list]:
+    """Library names last seen on the team's site, or None if unknown/stale."""
+    hit = _site_drives.get(teams_id)
+    if hit is None or time.time() - hit[1] > SITE_DRIVES_TTL:
+        return None
+    return hit[0]
+
+
+def remember_site_drives(teams_id: str, names: list) -> None:
+    _site_drives[teams_id] = (sorted(names), time.time())
+
+
+# ─── Cached upserts ────────────────────────────────────────────────────────────
+
+async def upsert_professor(pool: asyncpg.Pool, *, name: str, email: str) -> UUID:
+    values = [name]
+    cached = _lookup(_professors, email, values)
+    if cached is not None:
+        return cached
+    row_id = await db_mod.upsert_professor(pool, name=name, email=email)
+    _professors[email] = (values, str(row_id))
+    return row_id
+
+
+async def upsert_cursos(pool: asyncpg.Pool, rows: List[Tuple[str, str]]) -> Dict[str, UUID]:
+    """
+    Cached bulk upsert for (name, teams_id) pairs; only cache misses reach
+    the DB, in a single statement. Returns {teams_id: curso UUID}.
+    """
+    ids: Dict[str, UUID] = {}
+    misses: List[Tuple[str, str]] = []
+    for name, teams_id in rows:
+        cached = _lookup(_cursos, teams_id, [name])
+        if cached is not None:
+            ids[teams_id] = cached
+        else:
+            misses.append((name, teams_id))
+
+    if misses:
+        fresh = await db_mod.upsert_cursos(pool, misses)
+        for name, teams_id in misses:
+            ids[teams_id] = fresh[teams_id]
+            _cursos[teams_id] = ([name], str(fresh[teams_id]))
+    return ids
+
+
+def _class_values(name, curso_id, professor_id, semester, class_year) -> list:
+    return [
+        name, str(curso_id),
+        str(professor_id) if professor_id else None,
+        semester, class_year,
+    ]
+
+
+async def upsert_classes(pool: asyncpg.Pool, rows: List[dict]) -> Dict[str, UUID]:
+    """
+    Cached db.upsert_classes: rows are the same dicts.
+    Only rows that miss the cache reach the DB, in a single statement.
+    Returns {teams_channel_id: class UUID} for every row.
+    """
+    ids: Dict[str, UUID] = {}
+    misses: List[dict] = []
+    for row in rows:
+        values = _class_values(
+            row["name"], row["curso_id"], row["professor_id"],
+            row["semester"], row["class_year"],
+        )
+        cached = _lookup(_classes, row["teams_channel_id"], values)
+        if cached is not None:
+            ids[row["teams_channel_id"]] = cached
+        else:
+            misses.append(row)
+
+    if misses:
+        fresh = await db_mod.upsert_classes(pool, misses)
+        for row in misses:
+            key = row["teams_channel_id"]
+            ids[key] = fresh[key]
+            _classes[key] = (
+                _class_values(
+                    row["name"], row["curso_id"], row["professor_id"],
+                    row["semester"], row["class_year"],
+                ),
+                str(fresh[key]),
+            )
+    return ids
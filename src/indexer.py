@@ -8,7 +8,8 @@ Run modes:
     python -m src.indexer          # backfill all un-indexed PDFs
     await run_incremental(pool)    # called from main.py after scraping
 
-The pdfminer call is CPU-bound so we use asyncio.to_thread() to avoid
+S3 reads go through aioboto3 on the event loop itself (one shared client per
+run). The pdfminer call is CPU-bound so we use asyncio.to_thread() to avoid
 blocking the event loop. Concurrency is capped to avoid OOM on small instances.
 """
 import asyncio
@@ -17,9 +18,10 @@ import os
 from io import BytesIO
 
 import asyncpg
-import boto3
 from pdfminer.high_level import extract_text
 
+from src import db, storage
+
 log = logging.getLogger("backup_teams.indexer")
 
 INDEX_CONCURRENCY = int(os.getenv("INDEX_CONCURRENCY", "4"))
@@ -27,11 +29,11 @@ INDEX_CONCURRENCY = int(os.getenv("INDEX_CONCURRENCY", "4"))
 
 # ─── S3 helper ────────────────────────────────────────────────────────────────
 
-def _fetch_pdf_bytes(bucket: str, s3_key: str) -> bytes:
-    """Blocking S3 download — called inside asyncio.to_thread."""
-    s3 = boto3.client("s3")
-    resp = s3.get_object(Bucket=bucket, Key=s3_key)
-    return resp["Body"].read()
+async def _fetch_pdf_bytes(s3, bucket: str, s3_key: str) -> bytes:
+    """Async S3 download on the shared aioboto3 client."""
+    resp = await s3.get_object(Bucket=bucket, Key=s3_key)
+    async with resp["Body"] as body:
+        return await body.read()
 
 
 def _extract_text_from_bytes(pdf_bytes: bytes) -> str:
@@ -43,6 +45,7 @@ def _extract_text_from_bytes(pdf_bytes: bytes) -> str:
 
 async def _index_one(
     pool: asyncpg.Pool,
+    s3,
     bucket: str,
     semaphore: asyncio.Semaphore,
     row: asyncpg.Record,
@@ -54,7 +57,7 @@ async def _index_one(
     async with semaphore:
         log.info("[INDEX] %s", name)
         try:
-            pdf_bytes = await asyncio.to_thread(_fetch_pdf_bytes, bucket, s3_key)
+            pdf_bytes = await _fetch_pdf_bytes(s3, bucket, s3_key)
             text      = await asyncio.to_thread(_extract_text_from_bytes, pdf_bytes)
             text      = text.strip()
         except Exception as exc:
@@ -93,10 +96,11 @@ async def run_incremental(pool: asyncpg.Pool) -> int:
 
     log.info("[INDEX] Indexing %d PDFs…", len(rows))
     semaphore = asyncio.Semaphore(INDEX_CONCURRENCY)
-    await asyncio.gather(
-        *[_index_one(pool, bucket, semaphore, row) for row in rows],
-        return_exceptions=True,
-    )
+    async with storage.open_client() as s3:
+        await asyncio.gather(
+            *[_index_one(pool, s3, bucket, semaphore, row) for row in rows],
+            return_exceptions=True,
+        )
     log.info("[INDEX] Done.")
     return len(rows)
 
@@ -110,11 +114,9 @@ async def _backfill():
     load_dotenv()
     setup_logging()
 
-    dsn = (
-        f"postgresql://{os.environ['DB_USER']}:{os.environ['DB_PASSWORD']}"
-        f"@{os.environ['DB_HOST']}:{os.environ['DB_PORT']}/{os.environ['DB_NAME']}"
-    )
-    pool = await asyncpg.create_pool(dsn)
+    # Same pool settings as the scraper; db sizes it for INDEX_CONCURRENCY
+    # too, so workers never queue on acquire.
+    pool = await db.init_pool()
     count = await run_incremental(pool)
     await pool.close()
     print(f"Indexed {count} PDFs.")
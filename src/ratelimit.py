@@ -0,0 +1,215 @@
+"""
+src/ratelimit.py — Runtime-adjustable concurrency control for Graph traffic.
+
+AdmissionController
+-------------------
+A counting gate like asyncio.Semaphore, except its limit can be changed
+while tasks are waiting (Semaphore only allows that by poking at its
+private _value). The scraper uses it for DOWNLOAD_CONCURRENCY:
+
+  - GraphClient reports every 429 → throttle() halves the limit (min 1)
+  - each successful download       → recover() raises it by 1, up to the
+                                     configured ceiling
+
+i.e. additive-increase / multiplicative-decrease around the configured cap.
+
+VegasLimiter
+------------
+An AdmissionController for Graph API calls whose limit follows observed
+latency instead of a fixed guess (TCP Vegas, as in Netflix's
+concurrency-limits): with the fastest recent round trip as the no-queue
+baseline, limit * (1 - min_rtt / rtt) estimates how many requests are
+queued at the server. Below alpha the limit grows by one, above beta it
+shrinks by one; a 429 still halves it.
+
+Only successful (2xx) responses are sampled — a fast 404 or 429 says
+nothing about queueing. Each request kind (a single GET, a 20-request
+/$batch POST) keeps its own baseline, and a baseline only covers the
+last one or two `window`s, so a lucky early sample cannot pin it down
+for the rest of the run.
+
+TokenBucket
+-----------
+Paces the *rate* of Graph requests (requests/second), which is what Graph
+actually meters — the admission controller only bounds how many downloads
+are in flight. On a 429 the bucket is drained and blocked until the
+server's Retry-After deadline, so every waiting task backs off together.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Tuple
+
+log = logging.getLogger("backup_teams.ratelimit")
+
+
+class AdmissionController:
+    """Condition-variable guarded counter with a resizable limit."""
+
+    def __init__(self, limit: int) -> None:
+        self._active  = 0
+        self._limit   = limit
+        self._ceiling = limit
+        self._cv      = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    async def acquire(self) -> None:
+        async with self._cv:
+            await self._cv.wait_for(lambda: self._active < self._limit)
+            self._active += 1
+
+    async def release(self) -> None:
+        async with self._cv:
+            self._active -= 1
+            self._cv.notify(1)
+
+    async def __aenter__(self) -> "AdmissionController":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.release()
+
+    async def set_limit(self, limit: int) -> None:
+        """
+        Change the number of concurrent admissions. Lowering it never
+        interrupts running holders — new entries simply wait until enough
+        of them release.
+        """
+        async with self._cv:
+            raised = limit > self._limit
+            self._limit = limit
+            if raised:
+                self._cv.notify_all()
+
+    async def throttle(self, retry_after: float = 0) -> None:
+        """Back-pressure signal (a 429): halve the limit, never below 1."""
+        new_limit = max(1, self._limit // 2)
+        if new_limit < self._limit:
+            log.warning(
+                "Throttled by Graph — download concurrency %d → %d",
+                self._limit, new_limit,
+            )
+            await self.set_limit(new_limit)
+
+    async def recover(self) -> None:
+        """Success signal: step the limit back up towards the ceiling."""
+        if self._limit < self._ceiling:
+            await self.set_limit(self._limit + 1)
+
+
+class VegasLimiter(AdmissionController):
+    """Latency-driven AdmissionController, bounded to [1, max_limit]."""
+
+    def __init__(
+        self,
+        limit: int,
+        max_limit: int,
+        alpha: float = 2,
+        beta: float = 4,
+        window: float = 30.0,
+    ) -> None:
+        super().__init__(limit)
+        self._ceiling = max_limit
+        self._alpha   = alpha
+        self._beta    = beta
+        self._window  = window
+        # kind → (min rtt this window, min rtt last window, window start)
+        self._rtts: Dict[str, Tuple[float, float, float]] = {}
+
+    @asynccontextmanager
+    async def use(self, kind: str = "") -> AsyncIterator[Callable[[], None]]:
+        """
+        Hold one slot for a request. Call the yielded function once the
+        response is known to be a success; only then is its round trip fed
+        to sample() under `kind`.
+        """
+        rtt = None
+
+        def succeeded() -> None:
+            nonlocal rtt
+            rtt = time.monotonic() - start
+
+        async with self:
+            start = time.monotonic()
+            yield succeeded
+        if rtt is not None:
+            await self.sample(rtt, kind)
+
+    def _baseline(self, rtt: float, kind: str) -> float:
+        """Record `rtt` and return the fastest `kind` round trip of the last 1–2 windows."""
+        now = time.monotonic()
+        current, previous, started = self._rtts.get(kind, (rtt, rtt, now))
+        if now - started >= self._window:
+            current, previous, started = rtt, current, now
+        current = min(current, rtt)
+        self._rtts[kind] = (current, previous, started)
+        return min(current, previous)
+
+    async def sample(self, rtt: float, kind: str = "") -> None:
+        """Adjust the limit from one successful round trip (seconds) of `kind`."""
+        if rtt <= 0:
+            return
+        min_rtt = self._baseline(rtt, kind)
+        limit = self._limit
+        queue = limit * (1 - min_rtt / rtt)
+        # Thresholds scale with the limit so large limits still move.
+        if queue < max(self._alpha, limit * 0.1):
+            new_limit = min(limit + 1, self._ceiling)
+        elif queue > max(self._beta, limit * 0.2):
+            new_limit = max(1, limit - 1)
+        else:
+            return
+        if new_limit != limit:
+            log.debug("Graph limit %d → %d (rtt %.3fs, queue %.1f)", limit, new_limit, rtt, queue)
+            await self.set_limit(new_limit)
+
+
+class TokenBucket:
+    """Monotonic-clock token bucket: `rate` tokens/second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        if rate <= 0 or capacity < 1:
+            raise ValueError(f"TokenBucket needs rate > 0 and capacity >= 1, got {rate}, {capacity}")
+        self._rate          = rate
+        self._capacity      = capacity
+        self._tokens        = float(capacity)
+        self._updated       = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock          = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens  = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self, tokens: int = 1) -> None:
+        """
+        Wait until `tokens` requests may be sent (a /$batch POST costs one
+        token per sub-request). Waiters are served in arrival order.
+        """
+        tokens = min(tokens, self._capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self._rate)
+
+    def throttle_until(self, deadline: float) -> None:
+        """Drain the bucket and admit nothing before `deadline` (monotonic)."""
+        self._blocked_until = max(self._blocked_until, deadline)
+        self._tokens  = 0.0
+        self._updated = max(self._updated, deadline)
+
+    async def throttle(self, retry_after: float) -> None:
+        """Throttle listener for GraphClient: honour the server's Retry-After."""
+        self.throttle_until(time.monotonic() + retry_after)
@@ -1,80 +1,221 @@
 """
 src/storage.py — AWS S3 operations.
 
-Wraps boto3 with three operations used by the downloader:
-  - upload_file   : put bytes into S3, return the s3_key
+Wraps aioboto3 with the operations used by the downloader:
+  - upload_stream : store an async stream of chunks under a content-
+                    addressed key (BLAKE2b of the bytes), skipping content
+                    already stored; a multipart upload once it outgrows one
+                    part — memory stays bounded by PART_SIZE *
+                    PART_CONCURRENCY whatever the file size
   - file_exists   : HEAD check — skip re-upload if already there
-  - generate_presigned_url : time-limited download link for the API
 
-All functions are synchronous (boto3 is sync). They run inside
-asyncio.to_thread() in the downloader so they don't block the event loop.
+All functions are coroutines running on the same event loop as the Graph
+calls — no thread-pool hop per S3 operation. One client is opened lazily
+and shared for the whole run; call close() once at shutdown.
 
 Credentials are read from the environment:
   AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, S3_BUCKET
 """
+import asyncio
+import hashlib
 import logging
 import os
+import uuid
+from typing import AsyncIterator, Callable
 
-import boto3
+import aioboto3
 from botocore.exceptions import ClientError
 
 log = logging.getLogger("backup_teams.storage")
 
+_session = aioboto3.Session()
+
+# Multipart upload tuning. S3 requires every part but the last to be at
+# least 5 MiB; streams shorter than one part go up as a single PUT.
+PART_SIZE        = 8 * 1024 * 1024
+PART_CONCURRENCY = 4
+# Multipart uploads land here until their content key is known; a bucket
+# lifecycle rule on this prefix cleans up after crashed runs.
+STAGING_PREFIX   = "incoming/"
+
+
+def open_client():
+    """
+    Return an async context manager yielding a fresh S3 client.
+
+    Use this for self-contained jobs (e.g. the indexer) that want to own
+    their client's lifetime: `async with open_client() as s3: ...`
+    """
+    return _session.client(
+        "s3",
+        region_name=os.environ.get("AWS_REGION", "us-east-1"),
+        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
+    )
+
+
 # ── Lazy singleton client ──────────────────────────────────────────────────────
 
 _s3_client = None
+_s3_context = None
+_client_lock = asyncio.Lock()
 
 
-def _client():
-    global _s3_client
+async def _client():
+    global _s3_client, _s3_context
     if _s3_client is None:
-        _s3_client = boto3.client(
-            "s3",
-            region_name=os.environ.get("AWS_REGION", "us-east-1"),
-            aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-        )
+        async with _client_lock:
+            if _s3_client is None:
+                _s3_context = open_client()
+                _s3_client  = await _s3_context.__aenter__()
     return _s3_client
 
 
+async def close() -> None:
+    """Close the shared client (and its connection pool) if it was opened."""
+    global _s3_client, _s3_context
+    if _s3_context is not None:
+        await _s3_context.__aexit__(None, None, None)
+    _s3_client  = None
+    _s3_context = None
+
+
 # ── Public API ─────────────────────────────────────────────────────────────────
 
-def upload_file(bucket: str, key: str, data: bytes) -> str:
+async def upload_stream(
+    bucket: str,
+    chunks: AsyncIterator[bytes],
+    key_for: Callable[[str], str],
+) -> str:
     """
-    Upload raw bytes to S3.
-
-    Returns the s3_key on success so callers can store it in the DB.
-    Raises on any AWS error — let the caller decide whether to retry.
+    Upload an async stream of byte chunks to S3 under key_for(digest), the
+    digest being the BLAKE2b-128 hex of the content, hashed as chunks
+    arrive. Content already stored under its key is not stored again, so a
+    renamed or moved file, or the same slides in two channels, cost one
+    object.
+
+    A stream that never fills one part is sent with a single put_object,
+    unless a HEAD finds its key already stored. Longer streams are gathered
+    into parts of at least PART_SIZE, with up to PART_CONCURRENCY
+    upload_part calls in flight so reading the source overlaps the upload.
+    Their key is only known at the end, so they are uploaded under
+    STAGING_PREFIX: if the content key already exists the multipart upload
+    is aborted before completion, otherwise it is completed and copied into
+    place. On any failure the multipart upload is aborted (no orphaned
+    parts are billed) and the error is re-raised.
+
+    Returns the s3_key on success.
     """
-    _client().put_object(Bucket=bucket, Key=key, Body=data)
-    log.info("[S3] uploaded s3://%s/%s (%d KB)", bucket, key, len(data) // 1024)
+    s3     = await _client()
+    digest = hashlib.blake2b(digest_size=16)
+    buf    = bytearray()
+    async for chunk in chunks:
+        digest.update(chunk)
+        buf += chunk
+        if len(buf) >= PART_SIZE:
+            break
+    else:
+        key = key_for(digest.hexdigest())
+        if await file_exists(bucket, key):
+            log.info("[S3] s3://%s/%s already stored — upload skipped", bucket, key)
+            return key
+        await s3.put_object(Bucket=bucket, Key=key, Body=bytes(buf))
+        log.info("[S3] uploaded s3://%s/%s (%d KB)", bucket, key, len(buf) // 1024)
+        return key
+
+    staging   = f"{STAGING_PREFIX}{uuid.uuid4().hex}"
+    upload_id = (await s3.create_multipart_upload(Bucket=bucket, Key=staging))["UploadId"]
+    etags: dict = {}
+    slots = asyncio.Semaphore(PART_CONCURRENCY)
+    parts = 0
+    size  = 0
+
+    async def put_part(number: int, body: bytes) -> None:
+        try:
+            resp = await s3.upload_part(
+                Bucket=bucket, Key=staging, UploadId=upload_id,
+                PartNumber=number, Body=body,
+            )
+            etags[number] = resp["ETag"]
+        finally:
+            slots.release()
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+
+            async def submit(body: bytes) -> None:
+                nonlocal parts, size
+                await slots.acquire()
+                parts += 1
+                size  += len(body)
+                tg.create_task(put_part(parts, body))
+
+            await submit(bytes(buf))
+            buf = bytearray()
+            async for chunk in chunks:
+                digest.update(chunk)
+                buf += chunk
+                if len(buf) >= PART_SIZE:
+                    await submit(bytes(buf))
+                    buf = bytearray()
+            if buf:
+                await submit(bytes(buf))
+
+        key    = key_for(digest.hexdigest())
+        stored = await file_exists(bucket, key)
+        if stored:
+            await s3.abort_multipart_upload(Bucket=bucket, Key=staging, UploadId=upload_id)
+        else:
+            await s3.complete_multipart_upload(
+                Bucket=bucket, Key=staging, UploadId=upload_id,
+                MultipartUpload={"Parts": [
+                    {"ETag": etags[n], "PartNumber": n} for n in sorted(etags)
+                ]},
+            )
+    except BaseException as exc:
+        try:
+            await s3.abort_multipart_upload(Bucket=bucket, Key=staging, UploadId=upload_id)
+        except Exception as abort_exc:
+            log.warning("[S3] Could not abort upload of %s: %s", staging, abort_exc)
+        # Surface the first real error rather than the TaskGroup's wrapper.
+        if isinstance(exc, BaseExceptionGroup):
+            raise exc.exceptions[0] from None
+        raise
+
+    if stored:
+        log.info("[S3] s3://%s/%s already stored — upload discarded", bucket, key)
+        return key
+
+    # Server-side copy (multipart for large objects); no bytes pass through us.
+    try:
+        await s3.copy({"Bucket": bucket, "Key": staging}, bucket, key)
+    finally:
+        # The content object (if copied) is what counts; a staging object
+        # left behind is swept by the incoming/ lifecycle rule.
+        try:
+            await s3.delete_object(Bucket=bucket, Key=staging)
+        except Exception as exc:
+            log.warning("[S3] Could not delete staging object %s: %s", staging, exc)
+    log.info(
+        "[S3] uploaded s3://%s/%s (%d KB, %d parts)", bucket, key, size // 1024, parts,
+    )
     return key
 
 
-def file_exists(bucket: str, key: str) -> bool:
+async def file_exists(bucket: str, key: str) -> bool:
     """
     Return True if the object already exists in S3 (cheap HEAD request).
 
     Used to skip re-uploading files that haven't changed.
     """
+    s3 = await _client()
     try:
-        _client().head_object(Bucket=bucket, Key=key)
+        await s3.head_object(Bucket=bucket, Key=key)
         return True
     except ClientError as e:
-        if e.response["Error"]["Code"] == "404":
+        # Without s3:ListBucket, S3 answers 403 rather than 404 for a
+        # missing key; a genuine permission problem surfaces on the PUT.
+        if e.response["Error"]["Code"] in ("404", "403"):
             return False
         raise
 
-
-def generate_presigned_url(bucket: str, key: str, expires: int = 3600) -> str:
-    """
-    Generate a time-limited pre-signed download URL.
-
-    Default TTL: 1 hour.  Used by the REST API so clients can download
-    files directly from S3 without the API proxying the bytes.
-    """
-    return _client().generate_presigned_url(
-        "get_object",
-        Params={"Bucket": bucket, "Key": key},
-        ExpiresIn=expires,
-    )
@@ -21,55 +21,88 @@ End-of-run report:
 import asyncio
 import logging
 import os
-from dataclasses import dataclass, field
-from pathlib import Path
+from array import array
+from collections import deque
 from typing import Optional
 from uuid import UUID
 
 import asyncpg
 
-from src.graph_client import GraphClient
+from src.graph_client import BATCH_LIMIT, GraphClient
 from src import db as db_mod
+from src import id_cache
 from src import downloader
-from src.utils import build_local_path, get_download_root, sanitize
+from src.ratelimit import AdmissionController, VegasLimiter
 
 log = logging.getLogger("backup_teams.scraper")
 
 DOWNLOAD_CONCURRENCY      = int(os.getenv("DOWNLOAD_CONCURRENCY", "4"))
-MAX_CHANNEL_RETRIES       = 0
-CHANNEL_RETRY_DELAY       = 5
+TEAM_CONCURRENCY          = int(os.getenv("TEAM_CONCURRENCY", "8"))
+# Channels walked at once within a single team, so a team with 50 channels
+# can't take the whole Graph request budget.
+CHANNEL_CONCURRENCY       = int(os.getenv("CHANNEL_CONCURRENCY", "4"))
+# In-flight Graph API calls: starting point and ceiling for the adaptive limit.
+GRAPH_CONCURRENCY         = int(os.getenv("GRAPH_CONCURRENCY", "10"))
+GRAPH_CONCURRENCY_MAX     = int(os.getenv("GRAPH_CONCURRENCY_MAX", "64"))
 # Seconds to wait before retrying an empty root folder.
 # SharePoint's content DB sometimes returns 0 items on the first call
 # to a newly-accessed or newly-provisioned site, then populates on retry.
 SHAREPOINT_WARM_UP_DELAY  = 3
+# Changed files waiting for a download worker, per drive walk.
+WALK_QUEUE_SIZE           = 1024
 
 
 # ─── Stats ─────────────────────────────────────────────────────────────────────
 
-@dataclass
 class ScrapingStats:
-    teams_total:    int = 0
-    teams_denied:   int = 0
-    teams_fallback: int = 0
-    channels_total: int = 0
-    files_new:      int = 0
-    files_skipped:  int = 0
-    files_error:    int = 0
+    """
+    Run counters packed into one unsigned 64-bit array, indexed by the
+    class constants below: increments are in-place item writes rather than
+    rebinding boxed int attributes, and summing per-team stats is a plain
+    element-wise add.
+    """
+
+    TEAMS_TOTAL    = 0
+    TEAMS_DENIED   = 1
+    TEAMS_FALLBACK = 2
+    CHANNELS_TOTAL = 3
+    FILES_NEW      = 4
+    FILES_SKIPPED  = 5
+    FILES_ERROR    = 6
+    _SIZE          = 7
+
+    __slots__ = ("_counts",)
+
+    def __init__(self) -> None:
+        self._counts = array("Q", [0]) * self._SIZE
+
+    def inc(self, idx: int, n: int = 1) -> None:
+        self._counts[idx] += n
+
+    def __getitem__(self, idx: int) -> int:
+        return self._counts[idx]
+
+    def merge(self, other: "ScrapingStats") -> None:
+        """Add another (per-team) ScrapingStats into this one."""
+        counts = self._counts
+        for i, n in enumerate(other._counts):
+            counts[i] += n
 
     def report(self) -> str:
+        c = self._counts
         lines = [
             "",
             "=" * 58,
             "  Scrape Complete — Summary",
             "=" * 58,
-            f"  Teams processed :  {self.teams_total}",
-            f"  Teams denied    :  {self.teams_denied}   (no channel access after retries)",
-            f"  Teams fallback  :  {self.teams_fallback} (primary channel only)",
-            f"  Channels walked :  {self.channels_total}",
+            f"  Teams processed :  {c[self.TEAMS_TOTAL]}",
+            f"  Teams denied    :  {c[self.TEAMS_DENIED]}   (no channel or primary channel access)",
+            f"  Teams fallback  :  {c[self.TEAMS_FALLBACK]} (primary channel only)",
+            f"  Channels walked :  {c[self.CHANNELS_TOTAL]}",
             "-" * 58,
-            f"  New files       :  {self.files_new}",
-            f"  Skipped (same)  :  {self.files_skipped}",
-            f"  Errors          :  {self.files_error}",
+            f"  New files       :  {c[self.FILES_NEW]}",
+            f"  Skipped (same)  :  {c[self.FILES_SKIPPED]}",
+            f"  Errors          :  {c[self.FILES_ERROR]}",
             "=" * 58,
             "",
         ]
@@ -79,169 +112,305 @@ class ScrapingStats:
 # ─── Professor detection ───────────────────────────────────────────────────────
 
 async def _resolve_professor(
-    graph: GraphClient,
     pool: asyncpg.Pool,
     team_id: str,
+    members,
 ) -> Optional[UUID]:
+    """
+    Upsert the team owner as professor. `members` is the owner list expanded
+    by list_joined_teams() or the member list from get_team_overview(), or
+    the exception raised while fetching it.
+    """
+    if isinstance(members, Exception):
+        log.warning("Could not fetch team members for %s: %s", team_id, members)
+        return None
+    owner = next((m for m in members if "owner" in (m.get("roles") or ())), None)
+    if owner is None:
+        return None
+    name  = owner.get("displayName", "Unknown")
+    email = owner.get("email") or owner.get("userId", "unknown@unknown.com")
     try:
-        members = await graph.get_team_members(team_id)
-        for m in members:
-            if "owner" in m.get("roles", []):
-                name  = m.get("displayName", "Unknown")
-                email = m.get("email") or m.get("userId", "unknown@unknown.com")
-                return await db_mod.upsert_professor(pool, name=name, email=email)
+        return await id_cache.upsert_professor(pool, name=name, email=email)
     except Exception as exc:
-        log.warning("Could not fetch team members for %s: %s", team_id, exc)
+        log.warning("Could not resolve professor for %s: %s", team_id, exc)
     return None
 
 
-# ─── Recursive folder walk ─────────────────────────────────────────────────────
+# ─── Breadth-first drive walk ──────────────────────────────────────────────────
 
-async def _walk_folder(
+async def _walk_drive(
     graph: GraphClient,
     pool: asyncpg.Pool,
-    semaphore: asyncio.Semaphore,
+    admission: AdmissionController,
     stats: ScrapingStats,
     *,
     drive_id: str,
-    item_id: str,
+    root_item_id: str,
     class_id: UUID,
-    local_base: Path,
+    label: str,
     is_root: bool = False,
 ) -> None:
+    """
+    Walk a drive's folder tree breadth-first, listing the first page of up
+    to BATCH_LIMIT folders per /$batch round trip.
+
+    The folder queue holds (folder item id, folder label) pairs; labels
+    ("Team/Channel/sub folder") only name folders in log lines. When a
+    folder has more pages, the rest is streamed by a dedicated task through
+    iter_drive_pages(), which prefetches page N+1 while page N is being
+    dispatched — a 10k-item folder pages continuously instead of waiting
+    one BFS wave per page.
+
+    Listing is the producer: the class's stored etags are fetched once up
+    front, each page's files are checked against them in memory, the
+    remainder is looked up by item id in one query per page, and the
+    changed ones are put on a bounded queue (with their stored etag), drained by
+    DOWNLOAD_CONCURRENCY worker tasks. Memory stays O(WALK_QUEUE_SIZE)
+    rather than one task per file, and a full queue pauses listing until
+    downloads catch up. Task bodies handle their own errors, so one failure
+    does not cancel its siblings.
+    """
+    queue: deque = deque([(root_item_id, label)])
+    files_q: asyncio.Queue = asyncio.Queue(maxsize=WALK_QUEUE_SIZE)
     try:
-        children = await graph.list_drive_children(drive_id, item_id)
+        known_etags = await db_mod.fetch_class_etags(pool, class_id)
     except Exception as exc:
-        log.error("Failed to list folder contents (item %s): %s", item_id, exc)
-        return
-
-    # SharePoint cache warming: the first API call to a newly-accessed site
-    # sometimes returns 0 items even though files exist. A short wait + retry
-    # triggers SharePoint to hydrate its content cache.
-    if is_root and not children:
-        log.debug("[DRIVES] Root folder empty on first call — warming up, retrying in %ds", SHAREPOINT_WARM_UP_DELAY)
-        await asyncio.sleep(SHAREPOINT_WARM_UP_DELAY)
-        try:
-            children = await graph.list_drive_children(drive_id, item_id)
-        except Exception as exc:
-            log.error("Failed to list folder contents on retry (item %s): %s", item_id, exc)
-            return
-
-    tasks = []
-    for child in children:
-        name = sanitize(child["name"])
-
-        if "folder" in child:
-            sub_folder = local_base / name
-            sub_folder.mkdir(parents=True, exist_ok=True)
-            tasks.append(
-                _walk_folder(
-                    graph, pool, semaphore, stats,
-                    drive_id=drive_id,
-                    item_id=child["id"],
-                    class_id=class_id,
-                    local_base=sub_folder,
-                )
-            )
-        elif "file" in child:
-            local_path = local_base / name
-            tasks.append(
-                _download_with_semaphore(
-                    graph, pool, semaphore, stats,
-                    drive_id=drive_id,
-                    item=child,
-                    class_id=class_id,
-                    local_path=local_path,
-                )
+        # Not fatal: each page's remaining files are still looked up by id.
+        log.warning("Could not prefetch etags for %s: %s", label, exc)
+        known_etags = {}
+
+    # Unchanged files are summed into one line per drive; per-file lines only
+    # at DEBUG, checked once here rather than per file.
+    skipped   = 0
+    log_skips = log.isEnabledFor(logging.DEBUG)
+
+    warmed_up = not is_root
+    streams   = 0                   # continuation streams still running
+    wake      = asyncio.Event()     # set when a stream queues a folder or ends
+
+    async def download_worker() -> None:
+        while (entry := await files_q.get()) is not None:
+            child, stored_etag = entry
+            await _download_with_semaphore(
+                graph, pool, admission, stats,
+                drive_id=drive_id,
+                item=child,
+                class_id=class_id,
+                known_etag=stored_etag,
             )
 
-    if tasks:
-        await asyncio.gather(*tasks, return_exceptions=True)
+    def skip(child: dict) -> None:
+        nonlocal skipped
+        if log_skips:
+            log.debug("[SKIP] %s (etag matches — already in S3)", child.get("name", "unknown"))
+        skipped += 1
+        stats.inc(ScrapingStats.FILES_SKIPPED)
+
+    async with asyncio.TaskGroup() as workers:
+        for _ in range(DOWNLOAD_CONCURRENCY):
+            workers.create_task(download_worker())
+
+        async with asyncio.TaskGroup() as tg:
+
+            async def dispatch(children: list, base: str) -> None:
+                files = []
+                for child in children:
+                    if "folder" in child:
+                        queue.append((child["id"], f"{base}/{child['name']}"))
+                        wake.set()
+                    elif "file" in child:
+                        # ── Etag check BEFORE admission ───────────────────────
+                        # Against the prefetched class etags, no DB round trip.
+                        if known_etags.get(child["id"]) == child.get("eTag", child["id"]):
+                            skip(child)
+                        else:
+                            files.append(child)
+                if not files:
+                    return
+
+                # The rest may still be archived (under another class, or the
+                # prefetch failed): one query for the page's remaining files.
+                try:
+                    stored = await db_mod.fetch_item_etags(pool, [f["id"] for f in files])
+                except Exception as exc:
+                    log.warning("Could not look up etags in %s: %s", base, exc)
+                    stored = {}
+                for child in files:
+                    stored_etag = stored.get(child["id"])
+                    if stored_etag == child.get("eTag", child["id"]):
+                        skip(child)
+                        continue
+                    await files_q.put((child, stored_etag))
+
+            async def stream_rest(next_link: str, base: str) -> None:
+                nonlocal streams
+                try:
+                    async for children in graph.iter_drive_pages(drive_id, next_link=next_link):
+                        await dispatch(children, base)
+                except Exception as exc:
+                    log.error("Failed to list remaining folder contents (%s): %s", base, exc)
+                finally:
+                    streams -= 1
+                    wake.set()
+
+            while queue or streams:
+                if not queue:
+                    wake.clear()
+                    await wake.wait()
+                    continue
+
+                wave  = [queue.popleft() for _ in range(min(BATCH_LIMIT, len(queue)))]
+                pages = await graph.list_children_pages(drive_id, [cursor for cursor, _ in wave])
+
+                ready = []
+                for (cursor, base), page in zip(wave, pages):
+                    if isinstance(page, Exception):
+                        log.error("Failed to list folder contents (item %s): %s", cursor, page)
+                        continue
+
+                    children  = page.get("value", [])
+                    next_link = page.get("@odata.nextLink")
+
+                    # SharePoint cache warming: the first API call to a newly-accessed
+                    # site sometimes returns 0 items even though files exist. A short
+                    # wait + retry triggers SharePoint to hydrate its content cache.
+                    if not warmed_up and cursor == root_item_id and not children and not next_link:
+                        warmed_up = True
+                        log.debug("[DRIVES] Root folder empty on first call — warming up, retrying in %ds", SHAREPOINT_WARM_UP_DELAY)
+                        await asyncio.sleep(SHAREPOINT_WARM_UP_DELAY)
+                        queue.append((cursor, base))
+                        continue
+                    warmed_up = True
+
+                    if next_link:
+                        streams += 1
+                        tg.create_task(stream_rest(next_link, base))
+
+                    ready.append(dispatch(children, base))
+
+                await asyncio.gather(*ready)
+
+        # Listing is done: one sentinel per worker ends the download loop.
+        for _ in range(DOWNLOAD_CONCURRENCY):
+            await files_q.put(None)
+
+        if skipped:
+            log.info("[SKIP] %d unchanged files in %s (etag matches — already in S3)", skipped, label)
 
 
 async def _download_with_semaphore(
     graph: GraphClient,
     pool: asyncpg.Pool,
-    semaphore: asyncio.Semaphore,
+    admission: AdmissionController,
     stats: ScrapingStats,
     **kwargs,
 ) -> None:
-    item      = kwargs.get("item", {})
-    item_id   = item["id"]
-    etag      = item.get("eTag", item.get("id"))
-    file_name = item.get("name", "unknown")
-
-    # ── Etag check BEFORE semaphore ───────────────────────────────────────────
-    # is_file_current is a cheap DB read — no reason to rate-limit it.
-    # Running all etag checks in parallel means 1000+ skip decisions happen
-    # concurrently; only files that actually need downloading enter the queue.
-    if await db_mod.is_file_current(pool, item_id, etag):
-        log.info("[SKIP] %s (etag matches — already in S3)", file_name)
-        stats.files_skipped += 1
-        return
+    file_name = kwargs.get("item", {}).get("name", "unknown")
 
-    # ── Actual download+upload is rate-limited by semaphore ──────────────────
-    async with semaphore:
+    # _walk_drive already dropped files whose etag matches and passes the
+    # stored etag on as known_etag, so the download is conditional on it.
+
+    # ── Actual download+upload is gated by the admission controller ─────────
+    async with admission:
         try:
             result = await downloader.download_item(graph, pool, **kwargs)
             if result == "ok":
-                stats.files_new += 1
+                stats.inc(ScrapingStats.FILES_NEW)
+                await admission.recover()
             elif result == "skip":
-                # download_item did its own etag check (race condition safe)
-                stats.files_skipped += 1
+                # Graph answered 304: unchanged since the stored etag
+                stats.inc(ScrapingStats.FILES_SKIPPED)
             else:
-                stats.files_error += 1
+                stats.inc(ScrapingStats.FILES_ERROR)
         except Exception as exc:
             log.error("Failed to download %s: %s", file_name, exc)
-            stats.files_error += 1
+            stats.inc(ScrapingStats.FILES_ERROR)
 
 
 # ─── Channel listing with retry + fallback ────────────────────────────────────
 
 async def _get_channels_with_fallback(
-    graph: GraphClient,
-    team_id: str,
     team_name: str,
     stats: ScrapingStats,
+    overview: dict,
 ) -> Optional[list]:
-    last_exc = None
-
-    for attempt in range(1, MAX_CHANNEL_RETRIES + 2):
-        try:
-            return await graph.list_channels(team_id)
-        except Exception as exc:
-            last_exc = exc
-            is_forbidden = "403" in str(exc) or "Forbidden" in str(exc)
+    """
+    Pick the channel list out of a get_team_overview() result.
 
-            if attempt <= MAX_CHANNEL_RETRIES and is_forbidden:
-                log.warning(
-                    "Channel list denied for %s — retrying in %ds (attempt %d/%d)",
-                    team_name, CHANNEL_RETRY_DELAY, attempt, MAX_CHANNEL_RETRIES + 1,
-                )
-                await asyncio.sleep(CHANNEL_RETRY_DELAY)
-            else:
-                break
+    The primary channel arrives in the same batch as the channel list, so
+    when Education tenants 403 on /channels for students the fallback is
+    already in hand — no extra round trip. Throttling is retried inside
+    GraphClient, so an error here is final for this run.
+    """
+    channels = overview["channels"]
+    if not isinstance(channels, Exception):
+        return channels
 
     log.warning(
-        "Channel list denied for %s after %d attempts — trying primary channel",
-        team_name, MAX_CHANNEL_RETRIES + 1,
+        "Channel list denied for %s (%s) — trying primary channel",
+        team_name, channels,
     )
-    try:
-        primary = await graph.get_primary_channel(team_id)
-        stats.teams_fallback += 1
-        return [primary]
-    except Exception as fallback_exc:
+    primary = overview["primary"]
+    if isinstance(primary, Exception):
         log.error(
             "Primary channel also denied for %s: %s",
-            team_name, fallback_exc,
+            team_name, primary,
         )
-        stats.teams_denied += 1
+        stats.inc(ScrapingStats.TEAMS_DENIED)
         return None
 
+    stats.inc(ScrapingStats.TEAMS_FALLBACK)
+    return [primary]
+
 
 # ─── Site drives enumeration ───────────────────────────────────────────────────
 
-_DEFAULT_LIBRARY_NAMES = {"documents", "arquivos", "documentos"}
+# Casefolded so the membership test is correct for non-ASCII casing rules.
+# "Shared Documents" is how SharePoint-provisioned teams name the default
+# library; missing it meant walking a duplicate of the channel files.
+_DEFAULT_LIBRARY_NAMES = frozenset(
+    map(str.casefold, ("Documents", "Arquivos", "Documentos", "Shared Documents"))
+)
+
+
+async def _site_id_from_drive(
+    graph: GraphClient,
+    drive: dict,
+    label: str,
+    team_name: str,
+) -> Optional[str]:
+    """siteId from a drive's own fields, else resolved from its webUrl."""
+    from urllib.parse import urlparse
+
+    # Try direct siteId fields first (standard provisioning)
+    site_id = (
+        (drive.get("parentReference") or {}).get("siteId")
+        or (drive.get("sharePointIds") or {}).get("siteId")
+    )
+    if site_id:
+        log.debug("[DRIVES] Got siteId via %s fields for %s", label, team_name)
+        return site_id
+
+    # Fall back to webUrl parsing (always present, even when siteId is null)
+    web_url = drive.get("webUrl", "")
+    if "/sites/" in web_url:
+        parsed = urlparse(web_url)
+        # webUrl is like: https://pucsp.sharepoint.com/sites/452516_4385_2/Documentos...
+        # We want the site path:  /sites/452516_4385_2
+        path_parts = parsed.path.split("/")
+        site_path = "/" + "/".join(path_parts[1:3])   # [sites, name]
+        try:
+            site = await graph.get_site_by_url(parsed.hostname, site_path)
+            site_id = site.get("id")
+            if site_id:
+                log.debug(
+                    "[DRIVES] Got siteId via webUrl (%s) for %s",
+                    web_url, team_name,
+                )
+                return site_id
+        except Exception as exc:
+            log.debug("[DRIVES] webUrl site resolve failed for %s: %s", team_name, exc)
+    return None
 
 
 async def _get_site_id_for_team(
@@ -249,6 +418,7 @@ async def _get_site_id_for_team(
     team_id: str,
     team_name: str,
     known_site_id: Optional[str] = None,
+    group_drive=None,
 ) -> Optional[str]:
     """
     Resolve the SharePoint siteId for a team.
@@ -258,74 +428,78 @@ async def _get_site_id_for_team(
       2. Parse webUrl from /groups/{id}/drive or /teams/{id}/drive response
          → GET /sites/{host}:{site_path} to get the real site ID
 
+    `group_drive` is the /groups/{id}/drive result (or its exception)
+    already fetched with the team overview; when given it is not requested
+    again.
+
     The siteId fields (parentReference.siteId, sharePointIds) are null for
     institutions with non-standard SharePoint provisioning. The webUrl is
     always present and gives us enough to resolve the site.
     """
-    from urllib.parse import urlparse
-
     if known_site_id:
         return known_site_id
 
-    for label, drive_coro in [
-        ("groups drive", graph.get_group_drive(team_id)),
-        ("teams drive",  graph.get_team_drive(team_id)),
-    ]:
-        try:
-            drive = await drive_coro
-        except Exception as exc:
-            log.debug("[DRIVES] %s failed for %s: %s", label, team_name, exc)
-            continue
-
-        # Try direct siteId fields first (standard provisioning)
-        site_id = (
-            (drive.get("parentReference") or {}).get("siteId")
-            or (drive.get("sharePointIds") or {}).get("siteId")
+    if group_drive is None:
+        # Both lookups go out at once; results are tried in preference order.
+        drives = await asyncio.gather(
+            graph.get_group_drive(team_id),
+            graph.get_team_drive(team_id),
+            return_exceptions=True,
         )
-        if site_id:
-            log.debug("[DRIVES] Got siteId via %s fields for %s", label, team_name)
-            return site_id
+    else:
+        drives = [group_drive, None]    # teams drive only if still needed
 
-        # Fall back to webUrl parsing (always present, even when siteId is null)
-        web_url = drive.get("webUrl", "")
-        if "/sites/" in web_url:
-            parsed = urlparse(web_url)
-            # webUrl is like: https://pucsp.sharepoint.com/sites/452516_4385_2/Documentos...
-            # We want the site path:  /sites/452516_4385_2
-            path_parts = parsed.path.split("/")
-            site_path = "/" + "/".join(path_parts[1:3])   # [sites, name]
+    for label, drive in zip(("groups drive", "teams drive"), drives):
+        if drive is None:
             try:
-                site = await graph.get_site_by_url(parsed.hostname, site_path)
-                site_id = site.get("id")
-                if site_id:
-                    log.debug(
-                        "[DRIVES] Got siteId via webUrl (%s) for %s",
-                        web_url, team_name,
-                    )
-                    return site_id
+                drive = await graph.get_team_drive(team_id)
             except Exception as exc:
-                log.debug("[DRIVES] webUrl site resolve failed for %s: %s", team_name, exc)
+                drive = exc
+        if isinstance(drive, Exception):
+            log.debug("[DRIVES] %s failed for %s: %s", label, team_name, drive)
+            continue
+        site_id = await _site_id_from_drive(graph, drive, label, team_name)
+        if site_id:
+            return site_id
 
     log.warning("[DRIVES] Could not resolve siteId for %s", team_name)
     return None
 
 
+def _class_row(
+    name: str,
+    curso_id: UUID,
+    professor_id: Optional[UUID],
+    teams_channel_id: str,
+) -> dict:
+    """upsert_classes() row for a channel or library, with the default term."""
+    return {
+        "name":             name,
+        "curso_id":         curso_id,
+        "professor_id":     professor_id,
+        "semester":         os.getenv("DEFAULT_SEMESTER", "Unknown"),
+        "class_year":       int(os.getenv("DEFAULT_YEAR", "2025")),
+        "teams_channel_id": teams_channel_id,
+    }
+
+
 async def _process_site_drives(
     graph: GraphClient,
     pool: asyncpg.Pool,
-    semaphore: asyncio.Semaphore,
+    admission: AdmissionController,
     stats: ScrapingStats,
     *,
     team_id: str,
     team_name: str,
     curso_id: UUID,
     professor_id: Optional[UUID],
-    download_root: str,
     known_site_id: Optional[str] = None,
+    group_drive=None,
     channels_accessible: bool = True,
 ) -> None:
     """
     Walk all SharePoint document libraries for a team's site.
+    `known_site_id` and `group_drive` are passed to _get_site_id_for_team().
 
     channels_accessible controls which libraries we skip:
     - True  → skip default 'Documentos'/'Documents' libraries because the
@@ -334,7 +508,7 @@ async def _process_site_drives(
               nothing else will walk 'Documentos', and that's where the files are.
     """
     site_id = await _get_site_id_for_team(
-        graph, team_id, team_name, known_site_id
+        graph, team_id, team_name, known_site_id, group_drive
     )
     if not site_id:
         return
@@ -344,43 +518,43 @@ async def _process_site_drives(
     except Exception as exc:
         log.warning("[DRIVES] Could not list site drives for %s: %s", team_name, exc)
         return
+    for d in drives:
+        d.setdefault("name", "unknown")
+    id_cache.remember_site_drives(team_id, [d["name"] for d in drives])
+
+    # Skip default libraries only when channels were accessible — channels
+    # already walked them via filesFolder. If channels were denied, we must
+    # walk them here since nothing else will.
+    if channels_accessible:
+        drives = [d for d in drives if d["name"].casefold() not in _DEFAULT_LIBRARY_NAMES]
+    class_ids = await id_cache.upsert_classes(pool, [
+        _class_row(d["name"], curso_id, professor_id, f"drive:{d['id']}")
+        for d in drives
+    ])
 
     for drive in drives:
-        drive_name = drive.get("name", "unknown")
+        drive_name = drive["name"]
         drive_id   = drive["id"]
-
-        if drive_name.lower() in _DEFAULT_LIBRARY_NAMES and channels_accessible:
-            # Skip only when channels were accessible — channels already walked
-            # the default library via filesFolder. If channels were denied,
-            # we must walk it here since nothing else will.
-            continue
+        class_id   = class_ids[f"drive:{drive_id}"]
 
         log.info("[DRIVES] %s — walking library %r", team_name, drive_name)
 
-        class_id = await db_mod.upsert_class(
-            pool,
-            name=drive_name,
-            curso_id=curso_id,
-            professor_id=professor_id,
-            semester=os.getenv("DEFAULT_SEMESTER", "Unknown"),
-            class_year=int(os.getenv("DEFAULT_YEAR", "2025")),
-            teams_channel_id=f"drive:{drive_id}",
-        )
-
-        try:
-            root = await graph.get_drive_root(drive_id)
-        except Exception as exc:
-            log.warning("[DRIVES] Could not get root of %r: %s", drive_name, exc)
-            continue
-
-        local_base = build_local_path(download_root, team_name, drive_name)
+        # The root normally comes expanded with the drive listing; only ask
+        # for it separately if Graph left it out.
+        root_id = (drive.get("root") or {}).get("id")
+        if not root_id:
+            try:
+                root_id = (await graph.get_drive_root(drive_id))["id"]
+            except Exception as exc:
+                log.warning("[DRIVES] Could not get root of %r: %s", drive_name, exc)
+                continue
 
-        await _walk_folder(
-            graph, pool, semaphore, stats,
+        await _walk_drive(
+            graph, pool, admission, stats,
             drive_id=drive_id,
-            item_id=root["id"],
+            root_item_id=root_id,
             class_id=class_id,
-            local_base=local_base,
+            label=f"{team_name}/{drive_name}",
             is_root=True,   # retry once if empty (SharePoint cache warming)
         )
 
@@ -391,122 +565,160 @@ async def _process_site_drives(
 async def _process_channel(
     graph: GraphClient,
     pool: asyncpg.Pool,
-    semaphore: asyncio.Semaphore,
+    admission: AdmissionController,
     stats: ScrapingStats,
     *,
     team_id: str,
     channel: dict,
-    curso_id: UUID,
-    professor_id: Optional[UUID],
-    download_root: str,
+    class_id: UUID,
     curso_name: str,
-) -> Optional[str]:
+    files_folder,
+) -> None:
     """
     Process a single channel's file tree.
-    Returns the SharePoint siteId discovered from the filesFolder response,
-    or None if the filesFolder could not be retrieved.
-    This siteId is used by the site drives pass to find custom libraries.
+
+    `class_id` comes from the team-wide upsert_classes() call, and
+    `files_folder` is the channel's root DriveItem, prefetched for every
+    channel of the team in one batch (or the exception for this channel).
     """
-    channel_id   = channel["id"]
     channel_name = channel.get("displayName", "unknown-channel")
 
     log.info("  Channel: %s", channel_name)
-    stats.channels_total += 1
-
-    class_id = await db_mod.upsert_class(
-        pool,
-        name=channel_name,
-        curso_id=curso_id,
-        professor_id=professor_id,
-        semester=os.getenv("DEFAULT_SEMESTER", "Unknown"),
-        class_year=int(os.getenv("DEFAULT_YEAR", "2025")),
-        teams_channel_id=channel_id,
-    )
+    stats.inc(ScrapingStats.CHANNELS_TOTAL)
 
-    try:
-        files_folder = await graph.get_files_folder(team_id, channel_id)
-    except Exception as exc:
-        log.warning("    No files folder for channel %s: %s", channel_name, exc)
-        return None
+    if isinstance(files_folder, Exception):
+        log.warning("    No files folder for channel %s: %s", channel_name, files_folder)
+        return
 
     drive_id     = files_folder["parentReference"]["driveId"]
     root_item_id = files_folder["id"]
 
-    # ── KEY: extract siteId from the filesFolder response ─────────────────────
-    # This is the actual SharePoint site ID for this team, regardless of whether
-    # /teams/{id}/drive works or not. Used by _process_site_drives.
-    site_id = files_folder.get("parentReference", {}).get("siteId")
-
-    local_base = build_local_path(download_root, curso_name, channel_name)
-
-    await _walk_folder(
-        graph, pool, semaphore, stats,
+    await _walk_drive(
+        graph, pool, admission, stats,
         drive_id=drive_id,
-        item_id=root_item_id,
+        root_item_id=root_item_id,
         class_id=class_id,
-        local_base=local_base,
+        label=f"{curso_name}/{channel_name}",
     )
 
-    return site_id
-
 
 # ─── Public entry point ────────────────────────────────────────────────────────
 
 async def _process_team(
     graph: GraphClient,
     pool: asyncpg.Pool,
-    semaphore: asyncio.Semaphore,
+    admission: AdmissionController,
     stats: ScrapingStats,
     team: dict,
-    download_root: str,
+    curso_id: UUID,
 ) -> None:
-    """Process a single team: channels + site drives. Called concurrently."""
+    """
+    Process a single team: channels + site drives. Called concurrently,
+    with a `stats` object owned by this team alone. `curso_id` comes from
+    the run-wide upsert_cursos() call in scrape_all.
+    """
     team_id   = team["id"]
     team_name = team.get("displayName", "unknown-team")
 
     log.info("Team: %s", team_name)
-    stats.teams_total += 1
+    stats.inc(ScrapingStats.TEAMS_TOTAL)
 
-    curso_id     = await db_mod.upsert_curso(pool, name=team_name, teams_id=team_id)
-    professor_id = await _resolve_professor(graph, pool, team_id)
+    # Channels, primary channel and group drive (plus members, unless
+    # list_joined_teams already expanded them) come back in one /$batch POST.
+    members = team.get("members")
+    overview = await graph.get_team_overview(team_id, include_members=members is None)
+    if members is None:
+        members = overview["members"]
+    professor_id = await _resolve_professor(pool, team_id, members)
 
     # ── Channel pass ─────────────────────────────────────────────────────────
-    channels = await _get_channels_with_fallback(graph, team_id, team_name, stats)
+    channels = await _get_channels_with_fallback(
+        team_name, stats, overview
+    )
 
+    files_folders: dict = {}
+    class_ids:     dict = {}
     known_site_id: Optional[str] = None
 
     if channels is not None:
-        channel_results = await asyncio.gather(
-            *[
-                _process_channel(
-                    graph, pool, semaphore, stats,
+        # One statement for every channel's class row.
+        class_ids = await id_cache.upsert_classes(pool, [
+            _class_row(ch.get("displayName", "unknown-channel"), curso_id, professor_id, ch["id"])
+            for ch in channels
+        ])
+        files_folders = await graph.get_files_folders(
+            team_id, [ch["id"] for ch in channels]
+        )
+        # ── KEY: extract siteId from the filesFolder responses ────────────────
+        # This is the actual SharePoint site ID for this team, regardless of
+        # whether /teams/{id}/drive works or not. Having it before any channel
+        # is walked lets the site drives pass run alongside the channels.
+        for folder in files_folders.values():
+            if not isinstance(folder, Exception):
+                known_site_id = (folder.get("parentReference") or {}).get("siteId")
+                if known_site_id:
+                    break
+
+    # Teams whose site held only the default library last time have nothing
+    # for the site drives pass to add while channels cover that library.
+    cached_drives = id_cache.site_drive_names(team_id)
+    skip_site_drives = (
+        channels is not None
+        and cached_drives is not None
+        and all(name.casefold() in _DEFAULT_LIBRARY_NAMES for name in cached_drives)
+    )
+    if skip_site_drives:
+        log.debug("[DRIVES] %s — only default libraries, skipping site drives", team_name)
+
+    channel_semaphore = asyncio.Semaphore(CHANNEL_CONCURRENCY)
+
+    async def _channel(ch: dict) -> None:
+        # Errors are logged with their traceback and counted here, so one
+        # failing channel neither cancels its siblings in the TaskGroup nor
+        # disappears silently.
+        try:
+            async with channel_semaphore:
+                await _process_channel(
+                    graph, pool, admission, stats,
                     team_id=team_id,
                     channel=ch,
-                    curso_id=curso_id,
-                    professor_id=professor_id,
-                    download_root=download_root,
+                    class_id=class_ids[ch["id"]],
                     curso_name=team_name,
+                    files_folder=files_folders[ch["id"]],
                 )
-                for ch in channels
-            ],
-            return_exceptions=True,
-        )
-        for result in channel_results:
-            if isinstance(result, str) and result:
-                known_site_id = result
-                break
-
-    # ── Site drives pass ──────────────────────────────────────────────────────
-    await _process_site_drives(
-        graph, pool, semaphore, stats,
-        team_id=team_id,
-        team_name=team_name,
-        curso_id=curso_id,
-        professor_id=professor_id,
-        download_root=download_root,
-        known_site_id=known_site_id,
-        channels_accessible=(channels is not None),
-    )
+        except Exception as exc:
+            log.error(
+                "Channel %s of %s failed: %s",
+                ch.get("displayName", ch["id"]), team_name, exc,
+                exc_info=exc,
+            )
+            stats.inc(ScrapingStats.FILES_ERROR)
+
+    async def _site_drives() -> None:
+        try:
+            await _process_site_drives(
+                graph, pool, admission, stats,
+                team_id=team_id,
+                team_name=team_name,
+                curso_id=curso_id,
+                professor_id=professor_id,
+                known_site_id=known_site_id,
+                group_drive=overview.get("drive"),
+                channels_accessible=(channels is not None),
+            )
+        except Exception as exc:
+            log.error(
+                "[DRIVES] Site drives pass failed for %s: %s", team_name, exc,
+                exc_info=exc,
+            )
+            stats.inc(ScrapingStats.FILES_ERROR)
+
+    # ── Channel pass + site drives pass, concurrently ─────────────────────────
+    async with asyncio.TaskGroup() as tg:
+        for ch in channels or ():
+            tg.create_task(_channel(ch))
+        if not skip_site_drives:
+            tg.create_task(_site_drives())
 
 
 async def scrape_all(
@@ -516,25 +728,69 @@ async def scrape_all(
     """
     Main orchestration loop — all teams processed concurrently.
 
-    The download semaphore (DOWNLOAD_CONCURRENCY) controls actual file I/O.
+    The admission controller (DOWNLOAD_CONCURRENCY) controls actual file
+    I/O; it halves on every Graph 429 and creeps back up on each success.
+    Graph API calls are gated separately by a latency-driven VegasLimiter
+    that settles between 1 and GRAPH_CONCURRENCY_MAX in-flight requests.
+    Independently, GraphClient's token bucket (GRAPH_RPS) paces the request
+    rate and pauses everyone until the Retry-After deadline when Graph
+    throttles.
     Team-level API calls (channel listing, drives, filesFolder) run in
-    parallel across all teams, eliminating idle wait time between them.
+    parallel across up to TEAM_CONCURRENCY teams at a time, eliminating idle
+    wait time between them without flooding Graph on large tenants.
+
+    Each team counts into its own ScrapingStats; they are summed into the
+    run total as teams finish, so no counter is shared across teams.
     """
-    download_root = get_download_root()
-    semaphore     = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    admission     = AdmissionController(DOWNLOAD_CONCURRENCY)
+    graph_limiter = VegasLimiter(GRAPH_CONCURRENCY, GRAPH_CONCURRENCY_MAX)
+    graph.set_limiter(graph_limiter)
+    graph.add_throttle_listener(admission.throttle)
+    graph.add_throttle_listener(graph_limiter.throttle)
     stats         = ScrapingStats()
 
+    id_cache.load()
+    await id_cache.verify(pool)
+
     log.info("Fetching joined teams…")
     teams = await graph.list_joined_teams()
     log.info("Found %d teams — processing concurrently.", len(teams))
 
-    await asyncio.gather(
-        *[
-            _process_team(graph, pool, semaphore, stats, team, download_root)
-            for team in teams
-        ],
-        return_exceptions=True,
-    )
+    # Every team's curso row in one statement, before any team starts.
+    curso_ids = await id_cache.upsert_cursos(pool, [
+        (team.get("displayName", "unknown-team"), team["id"]) for team in teams
+    ])
+
+    team_semaphore = asyncio.Semaphore(TEAM_CONCURRENCY)
+
+    async def _bounded(team: dict) -> None:
+        team_stats = ScrapingStats()
+        try:
+            async with team_semaphore:
+                await _process_team(
+                    graph, pool, admission, team_stats, team,
+                    curso_ids[team["id"]],
+                )
+        except Exception as exc:
+            log.error("Team %s failed: %s", team.get("displayName", team["id"]), exc)
+            team_stats.inc(ScrapingStats.FILES_ERROR)
+        finally:
+            stats.merge(team_stats)
+
+    # Archive records from download_item are written in bulk by this task.
+    flusher = asyncio.create_task(downloader.run_flusher(pool))
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for team in teams:
+                tg.create_task(_bounded(team))
+    finally:
+        flusher.cancel()
+        await asyncio.gather(flusher, return_exceptions=True)
+        try:
+            await downloader.flush(pool)
+        except Exception as exc:
+            log.error("Failed to record archived files: %s", exc)
+        id_cache.save()
 
     log.info("All teams processed.")
     return stats
@@ -0,0 +1,61 @@
+"""
+tests/conftest.py — Fixtures wiring tests/fakes.py into the downloader and scraper.
+"""
+import asyncio
+
+import pytest
+
+from src import downloader, storage, teams_scraper
+from tests.fakes import FakeDB, FakeGraph, FakeS3, FakeStorage
+
+
+def pytest_asyncio_loop_factories(config, item):
+    """Run the tests on uvloop when it is installed (it is in the image)."""
+    try:
+        import uvloop
+    except ImportError:
+        return {"asyncio": asyncio.new_event_loop}
+    return {"uvloop": uvloop.new_event_loop}
+
+
+@pytest.fixture
+def fake_db(monkeypatch) -> FakeDB:
+    """FakeDB behind downloader's archive writes, with an empty write queue."""
+    db = FakeDB()
+    monkeypatch.setattr(downloader, "db_mod", db)
+    monkeypatch.setattr(downloader, "_pending", downloader._PendingUpserts())
+    return db
+
+
+@pytest.fixture
+def fake_storage(monkeypatch) -> FakeStorage:
+    store = FakeStorage()
+    monkeypatch.setattr(downloader, "storage", store)
+    return store
+
+
+@pytest.fixture
+def fake_s3(monkeypatch) -> FakeS3:
+    """FakeS3 behind the real storage module, with 1000-byte parts."""
+    s3 = FakeS3()
+
+    async def client():
+        return s3
+
+    monkeypatch.setattr(storage, "_client", client)
+    monkeypatch.setattr(storage, "PART_SIZE", 1000)
+    return s3
+
+
+@pytest.fixture
+def fakes(fake_storage, fake_db):
+    """(graph, storage, db) fakes for a download_item() call."""
+    return FakeGraph(), fake_storage, fake_db
+
+
+@pytest.fixture
+def scraper_db(monkeypatch) -> FakeDB:
+    """FakeDB behind the scraper's etag lookups."""
+    db = FakeDB()
+    monkeypatch.setattr(teams_scraper, "db_mod", db)
+    return db
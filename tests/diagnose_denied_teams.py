@@ -39,6 +39,19 @@ def fail(label: str, exc):
     print(f"  ❌  {label}: {type(exc).__name__} — {exc}")
 
 
+def unwrap(result):
+    """Batched lookups hand back exceptions as values — raise them here."""
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+async def first_page(graph: GraphClient, drive_id: str, item_id: str) -> list:
+    """Children on a folder's first page — enough for a diagnosis."""
+    [page] = await graph.list_children_pages(drive_id, [item_id])
+    return unwrap(page).get("value", [])
+
+
 async def diagnose_team(graph: GraphClient, team_id: str, name: str):
     print()
     print("=" * 70)
@@ -46,20 +59,23 @@ async def diagnose_team(graph: GraphClient, team_id: str, name: str):
     print(f"  {team_id}")
     print("=" * 70)
 
+    # Channels, primary channel and group drive in one /$batch round trip.
+    overview = await graph.get_team_overview(team_id, include_members=False)
+
     # ── 1. Channels ─────────────────────────────────────────────────────────
     channels = None
     try:
-        channels = await graph.list_channels(team_id)
-        ok(f"list_channels → {len(channels)} channel(s)")
+        channels = unwrap(overview["channels"])
+        ok(f"channels → {len(channels)} channel(s)")
         for ch in channels:
             print(f"       • {ch.get('displayName')} ({ch['id'][:20]}…)")
     except Exception as e:
-        fail("list_channels", e)
+        fail("channels", e)
 
     # ── 2. Primary channel ───────────────────────────────────────────────────
     primary = None
     try:
-        primary = await graph.get_primary_channel(team_id)
+        primary = unwrap(overview["primary"])
         ok(f"primaryChannel → {primary.get('displayName')}")
     except Exception as e:
         fail("primaryChannel", e)
@@ -71,7 +87,7 @@ async def diagnose_team(graph: GraphClient, team_id: str, name: str):
         ch_id   = ch["id"]
         ch_name = ch.get("displayName", "?")
         try:
-            ff = await graph.get_files_folder(team_id, ch_id)
+            ff = unwrap((await graph.get_files_folders(team_id, [ch_id]))[ch_id])
             drive_id     = ff["parentReference"]["driveId"]
             site_id_from_folder = ff.get("parentReference", {}).get("siteId")
             root_item_id = ff["id"]
@@ -80,7 +96,7 @@ async def diagnose_team(graph: GraphClient, team_id: str, name: str):
 
             # Walk direct children of the channel root
             try:
-                children = await graph.list_drive_children(drive_id, root_item_id)
+                children = await first_page(graph, drive_id, root_item_id)
                 if children:
                     ok(f"  drive children → {len(children)} item(s)")
                     for c in children[:5]:
@@ -88,14 +104,14 @@ async def diagnose_team(graph: GraphClient, team_id: str, name: str):
                 else:
                     print(f"       (folder is empty)")
             except Exception as e:
-                fail(f"  list_drive_children [{ch_name}]", e)
+                fail(f"  drive children [{ch_name}]", e)
         except Exception as e:
             fail(f"filesFolder[{ch_name}]", e)
 
     # ── 4. Groups drive ──────────────────────────────────────────────────────
     group_drive_web_url = None
     try:
-        gd = await graph.get_group_drive(team_id)
+        gd = unwrap(overview["drive"])
         group_drive_web_url = gd.get("webUrl", "")
         ok(f"groups/drive  webUrl={group_drive_web_url}")
     except Exception as e:
@@ -120,7 +136,7 @@ async def diagnose_team(graph: GraphClient, team_id: str, name: str):
                 # Walk root of each drive
                 try:
                     root = await graph.get_drive_root(d["id"])
-                    children = await graph.list_drive_children(d["id"], root["id"])
+                    children = await first_page(graph, d["id"], root["id"])
                     if children:
                         print(f"         → {len(children)} item(s) in root")
                         for c in children[:3]:
@@ -0,0 +1,203 @@
+"""
+tests/fakes.py — In-memory stand-ins for the downloader's collaborators.
+
+Plain classes with async methods that record what they were asked to do in
+a `calls` list, so tests assert on data instead of configuring MagicMocks.
+Installed by the fixtures in tests/conftest.py.
+"""
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import asyncpg
+from botocore.exceptions import ClientError
+
+FILE_BYTES = b"%PDF-1.4 fake content"
+
+
+class FakeGraph:
+    """
+    GraphClient.stream_file(): yields `payload` in `chunk_size` pieces, or
+    None (a 304) when payload is None. `chunk_delay` simulates read latency
+    and `close_delay` the time taken to close the response; reads are
+    logged to `events` when given.
+    """
+
+    def __init__(
+        self,
+        payload: Optional[bytes] = FILE_BYTES,
+        chunk_size: int = 1024,
+        chunk_delay: float = 0.0,
+        close_delay: float = 0.0,
+        events: Optional[list] = None,
+    ) -> None:
+        self.payload     = payload
+        self.chunk_size  = chunk_size
+        self.chunk_delay = chunk_delay
+        self.close_delay = close_delay
+        self.events      = events
+        self.calls: list = []           # (drive_id, item_id, if_none_match)
+
+    @asynccontextmanager
+    async def stream_file(self, drive_id, item_id, if_none_match=None):
+        self.calls.append((drive_id, item_id, if_none_match))
+        if self.payload is None:
+            yield None
+            return
+        try:
+            yield self._chunks()
+        finally:
+            if self.close_delay:
+                await asyncio.sleep(self.close_delay)
+
+    async def _chunks(self):
+        for n, i in enumerate(range(0, len(self.payload), self.chunk_size)):
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            if self.events is not None:
+                self.events.append(("read", n))
+            yield self.payload[i:i + self.chunk_size]
+
+
+class FakeDrive:
+    """
+    GraphClient's folder listing over an in-memory `tree` (folder id → list
+    of child items), `page_size` children per page. Folders missing from
+    the tree fail to list. Every page served is logged to `listed`.
+    """
+
+    def __init__(self, tree: dict, page_size: int = 3) -> None:
+        self.tree      = tree
+        self.page_size = page_size
+        self.listed: list = []          # "folder@offset" per page served
+
+    def _page(self, cursor: str):
+        folder, _, offset = cursor.partition("@")
+        offset = int(offset or 0)
+        if folder not in self.tree:
+            return RuntimeError(f"cannot list {folder}")
+        self.listed.append(f"{folder}@{offset}")
+        children = self.tree[folder]
+        page = {"value": children[offset:offset + self.page_size]}
+        if offset + self.page_size < len(children):
+            page["@odata.nextLink"] = f"{folder}@{offset + self.page_size}"
+        return page
+
+    async def list_children_pages(self, drive_id, cursors):
+        return [self._page(cursor) for cursor in cursors]
+
+    async def iter_drive_pages(self, drive_id, item_id=None, *, next_link=None):
+        cursor = next_link or item_id
+        while cursor:
+            await asyncio.sleep(0)
+            page = self._page(cursor)
+            if isinstance(page, Exception):
+                raise page
+            cursor = page.get("@odata.nextLink")
+            yield page["value"]
+
+
+class FakeStorage:
+    """
+    storage.upload_stream(): drains the chunks, then returns the content key
+    (from their BLAKE2b digest, as the real one does) or raises `raises`.
+    """
+
+    def __init__(self, raises: Optional[Exception] = None) -> None:
+        self.raises = raises
+        self.calls: list = []           # (bucket, key, uploaded bytes)
+
+    async def upload_stream(self, bucket, chunks, key_for):
+        data = b"".join([chunk async for chunk in chunks])
+        if self.raises is not None:
+            raise self.raises
+        key = key_for(hashlib.blake2b(data, digest_size=16).hexdigest())
+        self.calls.append((bucket, key, data))
+        return key
+
+
+class FakeDB:
+    """
+    db.upsert_archive_many(): records each batch of archive rows written.
+    Raises `raises` when set; a batch holding a drive_item_id in `rejects`
+    fails with a foreign-key violation, as a stale class_id would.
+
+    fetch_class_etags() / fetch_item_etags(): the stored etags in
+    `class_etags` (this class's archive) and `etags` (any class).
+    """
+
+    def __init__(self) -> None:
+        self.raises: Optional[Exception] = None
+        self.rejects: set = set()
+        self.class_etags: dict = {}     # drive_item_id → etag
+        self.etags: dict = {}           # drive_item_id → etag
+        self.calls: list = []           # one list of rows per written batch
+
+    async def fetch_class_etags(self, pool, class_id):
+        return dict(self.class_etags)
+
+    async def fetch_item_etags(self, pool, drive_item_ids):
+        return {i: self.etags[i] for i in drive_item_ids if i in self.etags}
+
+    async def upsert_archive_many(self, pool, rows):
+        rows = list(rows)
+        if self.raises is not None:
+            raise self.raises
+        if any(row["drive_item_id"] in self.rejects for row in rows):
+            raise asyncpg.ForeignKeyViolationError("archive_class_id_fkey")
+        self.calls.append(rows)
+
+
+class FakeS3:
+    """
+    The aioboto3 S3 client methods storage.upload_stream() uses. Part
+    uploads take `part_delay` seconds and are logged to `events` when given;
+    head_object finds only the keys in `existing`.
+    """
+
+    def __init__(self, part_delay: float = 0.0, events: Optional[list] = None) -> None:
+        self.part_delay = part_delay
+        self.events     = events
+        self.existing: set = set()
+        self.calls: list = []           # (method name, kwargs)
+
+    async def head_object(self, **kw):
+        self.calls.append(("head_object", kw))
+        if kw["Key"] not in self.existing:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {}
+
+    async def put_object(self, **kw):
+        self.calls.append(("put_object", kw))
+
+    async def create_multipart_upload(self, **kw):
+        self.calls.append(("create_multipart_upload", kw))
+        return {"UploadId": "up-1"}
+
+    async def upload_part(self, **kw):
+        number = kw["PartNumber"]
+        if self.events is not None:
+            self.events.append(("start", number))
+        if self.part_delay:
+            await asyncio.sleep(self.part_delay)
+        if self.events is not None:
+            self.events.append(("end", number))
+        self.calls.append(("upload_part", kw))
+        return {"ETag": f"p{number}"}
+
+    async def complete_multipart_upload(self, **kw):
+        self.calls.append(("complete_multipart_upload", kw))
+
+    async def abort_multipart_upload(self, **kw):
+        self.calls.append(("abort_multipart_upload", kw))
+
+    async def copy(self, CopySource, Bucket, Key):
+        self.calls.append(("copy", {"CopySource": CopySource, "Bucket": Bucket, "Key": Key}))
+
+    async def delete_object(self, **kw):
+        self.calls.append(("delete_object", kw))
+
+    def called(self, method: str) -> list:
+        """kwargs of every call to `method`, in call order."""
+        return [kw for name, kw in self.calls if name == method]
@@ -1,16 +1,26 @@
-import os
+"""
+Terminate every other connection to the database (e.g. after a crashed run
+left the pool's connections open). Run from the repo root:
+
+    python -m tests.scripts.kill
+"""
 import asyncio
 import asyncpg
 from dotenv import load_dotenv
 
+from src.db import dsn_from_env
+
 async def main():
     load_dotenv()
-    dsn = f"postgresql://{os.environ['DB_USER']}:{os.environ['DB_PASSWORD']}@{os.environ['DB_HOST']}:{os.environ['DB_PORT']}/{os.environ['DB_NAME']}?sslmode=require"
     try:
-        conn = await asyncpg.connect(dsn)
-        # Terminate all connections except this one
-        await conn.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE pid <> pg_backend_pid();")
-        await conn.close()
+        async with asyncpg.create_pool(
+            dsn_from_env(sslmode="require"),
+            min_size=1,
+            max_size=1,
+            statement_cache_size=0,   # one-off statement, nothing to reuse
+        ) as pool:
+            # Terminate all connections except this one
+            await pool.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE pid <> pg_backend_pid();")
         print("Terminated other active connections.")
     except Exception as e:
         print(f"Error: {e}")
@@ -3,9 +3,11 @@ import asyncio
 import asyncpg
 from dotenv import load_dotenv
 
+from src.db import dsn_from_env
+
 async def main():
     load_dotenv()
-    dsn = f"postgresql://{os.environ['DB_USER']}:{os.environ['DB_PASSWORD']}@{os.environ['DB_HOST']}:{os.environ['DB_PORT']}/{os.environ['DB_NAME']}?sslmode=require"
+    dsn = dsn_from_env(sslmode="require")
     try:
         conn = await asyncpg.connect(dsn, timeout=5)
         # Check active connections
@@ -5,155 +5,283 @@ S3-direct mode: files go Graph API → S3, never touching local disk.
 download_item() returns "skip", "ok", or "error".
 
 Test matrix:
-  1. test_skip_when_etag_matches    — etag in DB → returns "skip", nothing called
-  2. test_download_and_upload       — new file → returns "ok", local_path=None in DB
-  3. test_s3_failure_returns_error  — S3 upload throws → returns "error", no DB write
-  4. test_no_bucket_returns_error   — S3_BUCKET="" → returns "error", no DB write
-  5. test_etag_changed_overwrites   — etag differs → downloads again, returns "ok"
+  1. test_download_item             — parametrized over known_etag / bucket / upload outcome:
+       skip       known_etag matches → returns "skip", nothing called
+       ok         new file → returns "ok", content key in DB
+       s3_fail    S3 upload throws → returns "error", no DB write
+       no_bucket  S3_BUCKET="" → returns "error", no DB write
+  2. test_etag_changed_overwrites   — etag differs → downloads again, returns "ok"
+  3. test_not_modified_skips        — Graph answers 304 → returns "skip", no upload, etag refreshed
+  4. test_large_file_multipart      — file > PART_SIZE → streamed as S3 multipart upload
+  5. test_pipeline_overlaps         — Graph reads continue while parts are uploading
+  6. test_archive_writes_batched    — N downloads → one upsert_archive_many with N rows
+  7. test_dedup_hits_existing_object — content key already stored → multipart aborted
+  8. test_cancel_after_upload_does_not_orphan — cancelled once stored → record still written
+  9. test_rejected_row_does_not_block_batch — one bad row → dropped, the rest written
+ 10. test_failed_batch_retried_then_dropped — DB down → re-queued, dropped after N failures
+
+Graph, storage and the DB are the in-memory fakes from tests/fakes.py (see
+the fixtures in tests/conftest.py). Archive records are queued by
+download_item(); each test calls flush() to write them before asserting.
 """
-import os
-from pathlib import Path
-from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+import hashlib
+from collections import namedtuple
+from types import MappingProxyType
 
 import pytest
 
+from src import downloader
+from tests.fakes import FILE_BYTES, FakeGraph
+
 DRIVE_ID   = "drive-abc"
 ITEM_ID    = "item-001"
 ETAG       = "v1.0"
 NEW_ETAG   = "v2.0"
 FILE_NAME  = "lecture_notes.pdf"
-FILE_BYTES = b"%PDF-1.4 fake content"
 S3_BUCKET  = "backup-teams-files-rk"
-S3_KEY     = f"backup_teams/{FILE_NAME}"
-
-
-def _make_item(etag: str = ETAG) -> dict:
-    return {"id": ITEM_ID, "name": FILE_NAME, "eTag": etag, "file": {}}
-
-
-def _make_graph(file_bytes: bytes = FILE_BYTES) -> MagicMock:
-    graph = MagicMock()
-    graph.download_file = AsyncMock(return_value=file_bytes)
-    return graph
+S3_KEY     = f"backup_teams/{hashlib.blake2b(FILE_BYTES, digest_size=16).hexdigest()}.pdf"
+
+
+# Read-only: download_item() must not mutate the Graph item it is given.
+_ITEM_V1 = MappingProxyType({"id": ITEM_ID, "name": FILE_NAME, "eTag": ETAG,     "file": {}})
+_ITEM_V2 = MappingProxyType({"id": ITEM_ID, "name": FILE_NAME, "eTag": NEW_ETAG, "file": {}})
+
+
+# ── Test 1: skip / ok / S3 failure / no bucket ───────────────────────────────
+
+Case = namedtuple("Case", "known_etag bucket upload_raises expected streamed upserted")
+
+
+@pytest.mark.parametrize("case", [
+    Case(ETAG, S3_BUCKET, None,                   "skip",  streamed=False, upserted=False),
+    Case(None, S3_BUCKET, None,                   "ok",    streamed=True,  upserted=True),
+    Case(None, S3_BUCKET, Exception("AWS error"), "error", streamed=True,  upserted=False),
+    Case(None, "",        None,                   "error", streamed=False, upserted=False),
+], ids=["skip", "ok", "s3_fail", "no_bucket"])
+async def test_download_item(case, fakes):
+    graph, storage, db = fakes
+    storage.raises = case.upload_raises
+    result = await downloader.download_item(
+        graph, None,
+        drive_id=DRIVE_ID, item=_ITEM_V1,
+        class_id=None,
+        known_etag=case.known_etag,
+        settings=downloader.DownloaderSettings(s3_bucket=case.bucket),
+    )
+    await downloader.flush(None)
+
+    assert result == case.expected
+    assert graph.calls == ([(DRIVE_ID, ITEM_ID, None)] if case.streamed else [])
+    if case.upserted:
+        assert storage.calls == [(S3_BUCKET, S3_KEY, FILE_BYTES)]
+        [[row]] = db.calls
+        assert row["s3_key"] == S3_KEY
+        assert row["local_path"] is None
+    else:
+        assert storage.calls == []
+        assert db.calls == []
+
+
+# ── Test 2: etag changed → "ok", new etag in DB ──────────────────────────────
+
+async def test_etag_changed_overwrites(fakes):
+    graph, storage, db = fakes
+    result = await downloader.download_item(
+        graph, None,
+        drive_id=DRIVE_ID, item=_ITEM_V2,
+        class_id=None,
+        known_etag=ETAG,
+        settings=downloader.DownloaderSettings(s3_bucket=S3_BUCKET),
+    )
+    await downloader.flush(None)
 
+    assert result == "ok"
+    assert graph.calls == [(DRIVE_ID, ITEM_ID, ETAG)]
+    [[row]] = db.calls
+    assert row["etag"] == NEW_ETAG
 
-# ── Test 1: Skip ──────────────────────────────────────────────────────────────
 
-@pytest.mark.asyncio
-async def test_skip_when_etag_matches(tmp_path: Path):
-    from src import downloader
+# ── Test 3: 304 Not Modified → "skip", only the etag refreshed ───────────────
 
-    with (
-        patch("src.downloader.db_mod.is_file_current", new=AsyncMock(return_value=True)),
-        patch("src.downloader.db_mod.upsert_archive",  new=AsyncMock()) as mock_upsert,
-        patch("src.downloader.storage.upload_file") as mock_s3,
-    ):
-        result = await downloader.download_item(
-            _make_graph(), MagicMock(),
-            drive_id=DRIVE_ID, item=_make_item(ETAG),
-            class_id=None, local_path=tmp_path / FILE_NAME,
-        )
+async def test_not_modified_skips(fakes):
+    _, storage, db = fakes
+    result = await downloader.download_item(
+        FakeGraph(payload=None), None,
+        drive_id=DRIVE_ID, item=_ITEM_V2,
+        class_id=None,
+        known_etag=ETAG,
+        settings=downloader.DownloaderSettings(s3_bucket=S3_BUCKET),
+    )
+    await downloader.flush(None)
 
     assert result == "skip"
-    mock_s3.assert_not_called()
-    mock_upsert.assert_not_called()
-
-
-# ── Test 2: New file → "ok" ───────────────────────────────────────────────────
+    assert storage.calls == []
+    [[row]] = db.calls                          # new etag, stored s3_key kept
+    assert row["etag"] == NEW_ETAG
+    assert row["s3_key"] is None
 
-@pytest.mark.asyncio
-async def test_download_and_upload(tmp_path: Path):
-    from src import downloader
 
-    local_path = tmp_path / FILE_NAME
+# ── Test 4: large file → streamed through an S3 multipart upload ─────────────
 
-    with (
-        patch("src.downloader.db_mod.is_file_current", new=AsyncMock(return_value=False)),
-        patch("src.downloader.db_mod.upsert_archive",  new=AsyncMock()) as mock_upsert,
-        patch("src.downloader.storage.upload_file", return_value=S3_KEY),
-        patch.dict(os.environ, {"S3_BUCKET": S3_BUCKET}),
-    ):
-        downloader._S3_BUCKET = S3_BUCKET
-        result = await downloader.download_item(
-            _make_graph(), MagicMock(),
-            drive_id=DRIVE_ID, item=_make_item(ETAG),
-            class_id=None, local_path=local_path,
-        )
+async def test_large_file_multipart(fake_s3, fake_db):
+    big = FILE_BYTES * 100                      # 2.1 KB → several 1 KB parts
+    result = await downloader.download_item(
+        FakeGraph(big, chunk_size=300), None,
+        drive_id=DRIVE_ID, item=_ITEM_V1,
+        class_id=None,
+        known_etag=None,
+        settings=downloader.DownloaderSettings(s3_bucket=S3_BUCKET),
+    )
+    await downloader.flush(None)
 
     assert result == "ok"
-    assert not local_path.exists(), "S3-direct mode must not write to disk"
-    mock_upsert.assert_called_once()
-    _, kwargs = mock_upsert.call_args
-    assert kwargs["s3_key"] == S3_KEY
-    assert kwargs["local_path"] is None
-
-
-# ── Test 3: S3 failure → "error", no DB write ────────────────────────────────
-
-@pytest.mark.asyncio
-async def test_s3_failure_returns_error(tmp_path: Path):
-    from src import downloader
-
-    with (
-        patch("src.downloader.db_mod.is_file_current", new=AsyncMock(return_value=False)),
-        patch("src.downloader.db_mod.upsert_archive",  new=AsyncMock()) as mock_upsert,
-        patch("src.downloader.storage.upload_file", side_effect=Exception("AWS error")),
-        patch.dict(os.environ, {"S3_BUCKET": S3_BUCKET}),
-    ):
-        downloader._S3_BUCKET = S3_BUCKET
-        result = await downloader.download_item(
-            _make_graph(), MagicMock(),
-            drive_id=DRIVE_ID, item=_make_item(ETAG),
-            class_id=None, local_path=tmp_path / FILE_NAME,
-        )
-
-    assert result == "error"
-    mock_upsert.assert_not_called()
+    assert fake_s3.called("put_object") == []
+    assert fake_s3.called("abort_multipart_upload") == []
+    parts  = sorted(fake_s3.called("upload_part"), key=lambda kw: kw["PartNumber"])
+    bodies = [kw["Body"] for kw in parts]
+    assert b"".join(bodies) == big
+    assert all(len(b) >= 1000 for b in bodies[:-1])
+    [complete] = fake_s3.called("complete_multipart_upload")
+    assert complete["MultipartUpload"]["Parts"] == [
+        {"ETag": f"p{n}", "PartNumber": n} for n in range(1, len(bodies) + 1)
+    ]
+    # Staged under a temporary key, then copied to the content key.
+    big_key = f"backup_teams/{hashlib.blake2b(big, digest_size=16).hexdigest()}.pdf"
+    [copy] = fake_s3.called("copy")
+    assert copy["CopySource"] == {"Bucket": S3_BUCKET, "Key": complete["Key"]}
+    assert copy["Key"] == big_key
+    assert fake_s3.called("delete_object") == [{"Bucket": S3_BUCKET, "Key": complete["Key"]}]
+    [[row]] = fake_db.calls
+    assert row["s3_key"] == big_key
+
+
+# ── Test 5: Graph download and S3 upload overlap ─────────────────────────────
+
+async def test_pipeline_overlaps(fake_s3, fake_db):
+    events = []
+    fake_s3.events, fake_s3.part_delay = events, 0.05        # S3 write latency
+    graph = FakeGraph(b"x" * 6000, chunk_size=1000, chunk_delay=0.01, events=events)
+
+    result = await downloader.download_item(
+        graph, None,
+        drive_id=DRIVE_ID, item=_ITEM_V1,
+        class_id=None,
+        known_etag=None,
+        settings=downloader.DownloaderSettings(s3_bucket=S3_BUCKET),
+    )
 
+    assert result == "ok"
+    # Later chunks were read from Graph while part 1 was still uploading.
+    start, end = events.index(("start", 1)), events.index(("end", 1))
+    assert any(kind == "read" for kind, _ in events[start:end])
 
-# ── Test 4: No bucket → "error", no DB write ─────────────────────────────────
 
-@pytest.mark.asyncio
-async def test_no_bucket_returns_error(tmp_path: Path):
-    from src import downloader
+# ── Test 6: archive records are written in one bulk upsert ───────────────────
 
-    with (
-        patch("src.downloader.db_mod.is_file_current", new=AsyncMock(return_value=False)),
-        patch("src.downloader.db_mod.upsert_archive",  new=AsyncMock()) as mock_upsert,
-        patch("src.downloader.storage.upload_file") as mock_s3,
-    ):
-        downloader._S3_BUCKET = ""
+async def test_archive_writes_batched(fakes):
+    graph, _, db = fakes
+    for i in range(5):
+        item = {**_ITEM_V1, "id": f"item-{i}"}
         result = await downloader.download_item(
-            _make_graph(), MagicMock(),
-            drive_id=DRIVE_ID, item=_make_item(ETAG),
-            class_id=None, local_path=tmp_path / FILE_NAME,
+            graph, None,
+            drive_id=DRIVE_ID, item=item,
+            class_id=None,
+            known_etag=None,
+            settings=downloader.DownloaderSettings(s3_bucket=S3_BUCKET),
         )
+        assert result == "ok"
+    assert db.calls == []
+    await downloader.flush(None)
 
-    assert result == "error"
-    mock_s3.assert_not_called()
-    mock_upsert.assert_not_called()
+    [rows] = db.calls
+    assert [r["drive_item_id"] for r in rows] == [f"item-{i}" for i in range(5)]
 
 
-# ── Test 5: etag changed → "ok", new etag in DB ──────────────────────────────
+# ── Test 7: content already in S3 → multipart upload discarded ─────────────
 
-@pytest.mark.asyncio
-async def test_etag_changed_overwrites(tmp_path: Path):
-    from src import downloader
-
-    with (
-        patch("src.downloader.db_mod.is_file_current", new=AsyncMock(return_value=False)),
-        patch("src.downloader.db_mod.upsert_archive",  new=AsyncMock()) as mock_upsert,
-        patch("src.downloader.storage.upload_file", return_value=S3_KEY),
-        patch.dict(os.environ, {"S3_BUCKET": S3_BUCKET}),
-    ):
-        downloader._S3_BUCKET = S3_BUCKET
-        result = await downloader.download_item(
-            _make_graph(), MagicMock(),
-            drive_id=DRIVE_ID, item=_make_item(NEW_ETAG),
-            class_id=None, local_path=tmp_path / FILE_NAME,
-        )
+async def test_dedup_hits_existing_object(fake_s3, fake_db):
+    big     = FILE_BYTES * 100
+    big_key = f"backup_teams/{hashlib.blake2b(big, digest_size=16).hexdigest()}.pdf"
+    fake_s3.existing.add(big_key)
+    result = await downloader.download_item(
+        FakeGraph(big, chunk_size=300), None,
+        drive_id=DRIVE_ID, item=_ITEM_V1,
+        class_id=None,
+        known_etag=None,
+        settings=downloader.DownloaderSettings(s3_bucket=S3_BUCKET),
+    )
+    await downloader.flush(None)
 
     assert result == "ok"
-    mock_upsert.assert_called_once()
-    _, kwargs = mock_upsert.call_args
-    assert kwargs["etag"] == NEW_ETAG
+    assert fake_s3.called("upload_part") != []
+    assert fake_s3.called("complete_multipart_upload") == []
+    assert len(fake_s3.called("abort_multipart_upload")) == 1
+    assert fake_s3.called("copy") == []
+    [[row]] = fake_db.calls
+    assert row["s3_key"] == big_key
+
+
+# ── Test 8: cancelled after the upload → the archive record is still written ─
+
+async def test_cancel_after_upload_does_not_orphan(fake_storage, fake_db):
+    graph = FakeGraph(close_delay=10)                # slow to close the response
+    task  = asyncio.create_task(downloader.download_item(
+        graph, None,
+        drive_id=DRIVE_ID, item=_ITEM_V1,
+        class_id=None,
+        known_etag=None,
+        settings=downloader.DownloaderSettings(s3_bucket=S3_BUCKET),
+    ))
+    while not fake_storage.calls:                    # object is in S3 …
+        await asyncio.sleep(0)
+    task.cancel()                                    # … and the run is stopped
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await downloader.flush(None)
+
+    [[row]] = fake_db.calls
+    assert row["s3_key"] == S3_KEY
+
+
+# ── Test 9: a row the DB rejects is dropped, the rest of its batch written ───
+
+async def test_rejected_row_does_not_block_batch(fakes):
+    graph, _, db = fakes
+    db.rejects.add("item-2")
+    for i in range(5):
+        await downloader.download_item(
+            graph, None,
+            drive_id=DRIVE_ID, item={**_ITEM_V1, "id": f"item-{i}"},
+            class_id=None,
+            known_etag=None,
+            settings=downloader.DownloaderSettings(s3_bucket=S3_BUCKET),
+        )
+    await downloader.flush(None)
+
+    written = sorted(r["drive_item_id"] for rows in db.calls for r in rows)
+    assert written == ["item-0", "item-1", "item-3", "item-4"]
+    assert len(downloader._pending) == 0
+
+
+# ── Test 10: a failing batch is re-queued, then dropped after N attempts ─────
+
+async def test_failed_batch_retried_then_dropped(fakes, monkeypatch):
+    monkeypatch.setattr(downloader, "ARCHIVE_FLUSH_ATTEMPTS", 2)
+    graph, _, db = fakes
+    db.raises = ConnectionError("db down")
+    await downloader.download_item(
+        graph, None,
+        drive_id=DRIVE_ID, item=_ITEM_V1,
+        class_id=None,
+        known_etag=None,
+        settings=downloader.DownloaderSettings(s3_bucket=S3_BUCKET),
+    )
+
+    with pytest.raises(ConnectionError):
+        await downloader.flush(None)
+    assert len(downloader._pending) == 1             # re-queued for the next flush
+    with pytest.raises(ConnectionError):
+        await downloader.flush(None)
+    assert len(downloader._pending) == 0             # second failure: dropped
+    assert db.calls == []
@@ -0,0 +1,226 @@
+"""
+tests/test_graph_client.py — Unit tests for GraphClient's request layer.
+
+Graph is replaced by an httpx.MockTransport whose handler plays the server,
+so retries, batching and caching run through the real client code.
+
+Test matrix:
+  1. test_batch_missing_sub_response_retried — reply omits an id → only that id re-sent
+  2. test_batch_retries_only_failed_ids      — mixed 200/404/429/503 → only 429/503 re-sent
+  3. test_get_single_flight_and_cache        — concurrent identical GETs → one HTTP call
+  4. test_401_refreshes_token_once           — concurrent 401s → one refresh, each retried
+  5. test_401_after_refresh_raises           — still 401 with the new token → error, no loop
+  6. test_limiter_samples_only_success       — 2xx round trips reach the Vegas limiter, a 404 doesn't
+  7. test_drive_pages_exit_settles           — aclose() leaves no page prefetch running
+"""
+import asyncio
+
+import httpx
+import orjson
+import pytest
+
+from src import graph_client
+from src.graph_client import BASE_URL, GraphClient, GraphHTTPError, GraphNotFound
+from src.ratelimit import VegasLimiter
+
+
+@pytest.fixture
+async def make_graph(monkeypatch):
+    """GraphClient factory over a MockTransport `handler`, with no back-off sleeps."""
+    monkeypatch.setattr(graph_client, "RETRY_DELAY", 0.0)
+    clients = []
+
+    def make(handler, **kwargs) -> GraphClient:
+        graph = GraphClient("token-1", **kwargs)
+        graph._client = httpx.AsyncClient(
+            base_url=BASE_URL,
+            headers={"Authorization": "Bearer token-1"},
+            transport=httpx.MockTransport(handler),
+        )
+        clients.append(graph._client)
+        return graph
+
+    yield make
+    for client in clients:
+        await client.aclose()
+
+
+def _batch_ids(request: httpx.Request) -> list:
+    return [sub["id"] for sub in orjson.loads(request.content)["requests"]]
+
+
+# ── Test 1: sub-response missing from a $batch reply ─────────────────────────
+
+async def test_batch_missing_sub_response_retried(make_graph):
+    posts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        ids = _batch_ids(request)
+        posts.append(ids)
+        answered = ids if len(posts) > 1 else [i for i in ids if i != "b"]
+        return httpx.Response(200, json={"responses": [
+            {"id": i, "status": 200, "body": {"value": i}} for i in answered
+        ]})
+
+    graph   = make_graph(handler)
+    results = await graph._batch_get({"a": "/a", "b": "/b", "c": "/c"})
+
+    assert results == {"a": {"value": "a"}, "b": {"value": "b"}, "c": {"value": "c"}}
+    assert posts == [["a", "b", "c"], ["b"]]
+
+
+# ── Test 2: only the 429 / 503 sub-requests of a $batch are re-sent ─────────
+
+async def test_batch_retries_only_failed_ids(make_graph):
+    first = {
+        "ok":      {"status": 200, "body": {"value": "ok"}},
+        "missing": {"status": 404, "body": {"error": {"code": "itemNotFound"}}},
+        "limited": {"status": 429, "headers": {"Retry-After": "0"}},
+        "down":    {"status": 503},
+    }
+    posts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        ids = _batch_ids(request)
+        posts.append(ids)
+        if len(posts) == 1:
+            responses = [{"id": i, **first[i]} for i in ids]
+        else:
+            responses = [{"id": i, "status": 200, "body": {"value": i}} for i in ids]
+        return httpx.Response(200, json={"responses": responses})
+
+    throttles = []
+
+    async def on_throttle(retry_after: float) -> None:
+        throttles.append(retry_after)
+
+    graph = make_graph(handler)
+    graph.add_throttle_listener(on_throttle)
+    results = await graph._batch_get({sid: f"/{sid}" for sid in first})
+
+    assert posts == [list(first), ["limited", "down"]]
+    assert results["ok"] == {"value": "ok"}
+    assert results["limited"] == {"value": "limited"}
+    assert results["down"] == {"value": "down"}
+    assert isinstance(results["missing"], GraphNotFound)
+    assert throttles == [0.0]                   # the 429 throttled the limiters once
+
+
+# ── Test 3: identical concurrent GETs share one request, then the cache ──────
+
+async def test_get_single_flight_and_cache(make_graph):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(str(request.url))
+        return httpx.Response(200, json={"id": "team-1"})
+
+    graph   = make_graph(handler)
+    results = await asyncio.gather(*[graph._get("/teams/team-1") for _ in range(5)])
+    assert results == [{"id": "team-1"}] * 5
+    assert len(calls) == 1
+
+    assert await graph._get("/teams/team-1") == {"id": "team-1"}    # served from cache
+    assert len(calls) == 1
+    await graph._get("/teams/team-1", **{"$select": "id"})          # other params: new request
+    assert len(calls) == 2
+
+
+# ── Test 4: a burst of 401s triggers one token refresh ───────────────────────
+
+async def test_401_refreshes_token_once(make_graph):
+    refreshes = []
+
+    async def provider():
+        refreshes.append(1)
+        return "token-2"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.headers["Authorization"] != "Bearer token-2":
+            return httpx.Response(401)
+        return httpx.Response(200, json={"path": request.url.path})
+
+    graph   = make_graph(handler, token_provider=provider)
+    results = await asyncio.gather(*[graph._get(f"/items/{i}", cache=False) for i in range(3)])
+
+    assert [r["path"] for r in results] == [f"/v1.0/items/{i}" for i in range(3)]
+    assert len(refreshes) == 1
+
+
+# ── Test 5: still 401 after the refresh → error, not a refresh loop ──────────
+
+async def test_401_after_refresh_raises(make_graph):
+    refreshes = []
+    calls     = []
+
+    async def provider():
+        refreshes.append(1)
+        return "token-2"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.headers["Authorization"])
+        return httpx.Response(401)
+
+    graph = make_graph(handler, token_provider=provider)
+    with pytest.raises(GraphHTTPError) as exc_info:
+        await graph._get("/me", cache=False)
+
+    assert exc_info.value.status == 401
+    assert len(refreshes) == 1
+    assert calls == ["Bearer token-1", "Bearer token-2"]
+
+
+# ── Test 6: only 2xx responses are fed to the Vegas limiter ──────────────────
+
+async def test_limiter_samples_only_success(make_graph):
+    samples = []
+
+    class Recorder(VegasLimiter):
+        async def sample(self, rtt: float, kind: str = "") -> None:
+            samples.append(kind)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/gone"):
+            return httpx.Response(404, json={"error": {"code": "itemNotFound"}})
+        return httpx.Response(200, json={"responses": []} if request.method == "POST" else {})
+
+    graph = make_graph(handler)
+    graph.set_limiter(Recorder(4, max_limit=8))
+    await graph._get("/ok")
+    with pytest.raises(GraphNotFound):
+        await graph._get("/gone")
+    await graph._request("POST", "/$batch", json={"requests": []})
+
+    assert samples == ["GET", "POST"]
+
+
+# ── Test 7: leaving iter_drive_pages early settles the page prefetch ─────────
+
+async def test_drive_pages_exit_settles(make_graph):
+    sent, release = asyncio.Event(), asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if "skiptoken" in str(request.url):
+            sent.set()
+            await release.wait()                    # page 2 is still in flight
+            return httpx.Response(404, json={"error": {"code": "itemNotFound"}})
+        return httpx.Response(200, json={
+            "value": [{"id": "a"}],
+            "@odata.nextLink": f"{BASE_URL}/drives/d/items/root/children?$skiptoken=2",
+        })
+
+    def prefetches() -> list:
+        return [t for t in asyncio.all_tasks() if t.get_coro().__qualname__ == "GraphClient._get"]
+
+    graph = make_graph(handler)
+    pages = graph.iter_drive_pages("d", "root")
+    assert await anext(pages) == [{"id": "a"}]
+    await sent.wait()
+    assert len(prefetches()) == 1
+
+    await pages.aclose()
+    assert prefetches() == []                       # cancelled and awaited, not left behind
+
+    release.set()                                   # let the shared request finish
+    with pytest.raises(GraphNotFound):
+        await asyncio.gather(*graph._inflight.values())
@@ -0,0 +1,179 @@
+"""
+tests/test_ratelimit.py — Unit tests for the Graph concurrency and rate controls.
+
+Test matrix:
+  1. test_admission_aimd              — throttle() halves (floor 1), recover() +1 up to the ceiling
+  2. test_admission_blocks_at_limit   — acquire() waits at the limit; raising it admits waiters
+  3. test_vegas_grows_when_unqueued   — rtt at the baseline → limit +1, capped at max_limit
+  4. test_vegas_shrinks_when_queued   — rtt far above the baseline → limit -1
+  5. test_bucket_burst_then_paced     — capacity tokens at once, then one per 1/rate seconds
+  6. test_bucket_refills_over_time    — idle time refills the bucket, never past capacity
+  7. test_bucket_throttle_blocks      — throttle_until() holds every acquire until the deadline
+  8. test_vegas_mixed_kinds_hold      — interleaved GET / $batch rtts → limit climbs, not collapses
+  9. test_vegas_samples_only_success  — use() without the success call leaves the baseline alone
+ 10. test_vegas_baseline_expires      — a fast rtt stops counting as the baseline after two windows
+ 11. test_bucket_rejects_zero_rate    — GRAPH_RPS=0 fails at construction, not at the first wait
+
+Bucket timings use real sleeps of tens of milliseconds with loose bounds.
+"""
+import asyncio
+import time
+
+import pytest
+
+from src.ratelimit import AdmissionController, TokenBucket, VegasLimiter
+
+
+# ── Test 1: additive increase / multiplicative decrease ──────────────────────
+
+async def test_admission_aimd():
+    gate = AdmissionController(8)
+
+    await gate.throttle()
+    assert gate.limit == 4
+    for _ in range(5):
+        await gate.throttle()
+    assert gate.limit == 1
+
+    for _ in range(10):
+        await gate.recover()
+    assert gate.limit == 8                              # the configured ceiling
+
+
+# ── Test 2: admission blocks at the limit ────────────────────────────────────
+
+async def test_admission_blocks_at_limit():
+    gate = AdmissionController(1)
+    await gate.acquire()
+
+    waiter = asyncio.create_task(gate.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+
+    await gate.set_limit(2)                             # raising wakes the waiter
+    await asyncio.wait_for(waiter, 1)
+    await gate.release()
+    await gate.release()
+
+
+# ── Test 3: Vegas grows while requests are not queueing ──────────────────────
+
+async def test_vegas_grows_when_unqueued():
+    limiter = VegasLimiter(4, max_limit=6)
+
+    for _ in range(5):
+        await limiter.sample(0.1)                       # rtt == min_rtt: no queue
+    assert limiter.limit == 6
+
+
+# ── Test 4: Vegas shrinks once latency shows a queue ─────────────────────────
+
+async def test_vegas_shrinks_when_queued():
+    limiter = VegasLimiter(10, max_limit=20)
+
+    await limiter.sample(0.1)                           # baseline
+    assert limiter.limit == 11
+    await limiter.sample(1.0)                           # queue ≈ 11 * 0.9 ≈ 10 > beta
+    assert limiter.limit == 10
+
+    await limiter.throttle()                            # a 429 still halves it
+    assert limiter.limit == 5
+
+
+# ── Test 5: token bucket bursts, then paces ──────────────────────────────────
+
+async def test_bucket_burst_then_paced():
+    bucket = TokenBucket(rate=50, capacity=3)
+
+    start = time.monotonic()
+    for _ in range(3):
+        await bucket.acquire()
+    assert time.monotonic() - start < 0.01              # the burst is free
+
+    await bucket.acquire()
+    assert time.monotonic() - start >= 0.015            # ~1/50 s for the next token
+
+
+# ── Test 6: idle time refills the bucket, up to capacity ─────────────────────
+
+async def test_bucket_refills_over_time():
+    bucket = TokenBucket(rate=100, capacity=2)
+    await bucket.acquire(2)
+
+    await asyncio.sleep(0.1)                            # would be 10 tokens uncapped
+    start = time.monotonic()
+    await bucket.acquire(2)
+    assert time.monotonic() - start < 0.01
+    await bucket.acquire()
+    assert time.monotonic() - start >= 0.005            # only 2 were stored
+
+
+# ── Test 7: throttle_until blocks everyone until the deadline ────────────────
+
+async def test_bucket_throttle_blocks():
+    bucket = TokenBucket(rate=1000, capacity=10)
+
+    start = time.monotonic()
+    bucket.throttle_until(start + 0.05)
+    await asyncio.gather(bucket.acquire(), bucket.acquire())
+    assert time.monotonic() - start >= 0.045
+
+
+# ── Test 8: GET and /$batch round trips keep separate baselines ─────────────
+
+async def test_vegas_mixed_kinds_hold():
+    limiter = VegasLimiter(10, max_limit=64)
+
+    # Unloaded Graph: single GETs ~50 ms, 20-request batches ~0.5 s, each
+    # with a few percent of jitter. One shared baseline would read every
+    # batch as a 90% queue and walk the limit down to 1.
+    for i in range(200):
+        jitter = 1 + (i % 5) / 100
+        await limiter.sample(0.05 * jitter, "GET")
+        await limiter.sample(0.5 * jitter, "POST")
+    assert limiter.limit == 64
+
+
+# ── Test 9: only requests reported as successful are sampled ────────────────
+
+async def test_vegas_samples_only_success():
+    limiter = VegasLimiter(10, max_limit=20)
+    await limiter.sample(0.1, "GET")
+    assert limiter.limit == 11
+
+    async with limiter.use("GET"):                      # e.g. a fast 404: not reported
+        pass
+    assert limiter.limit == 11
+
+    await limiter.sample(1.0, "GET")                    # a real queue still shrinks it
+    assert limiter.limit == 10
+
+    async with limiter.use("GET") as succeeded:         # a fast 2xx grows it
+        succeeded()
+    assert limiter.limit == 11
+
+
+# ── Test 10: the baseline decays once its windows pass ───────────────────────
+
+async def test_vegas_baseline_expires():
+    limiter = VegasLimiter(10, max_limit=20, window=0.02)
+
+    await limiter.sample(0.01)                          # an outlier-fast baseline
+    await limiter.sample(0.1)
+    assert limiter.limit == 10                          # read as a queue: 11 → 10
+
+    await asyncio.sleep(0.05)
+    await limiter.sample(0.1)                           # next window: 0.01 still counts
+    assert limiter.limit == 9
+    await asyncio.sleep(0.05)
+    await limiter.sample(0.1)                           # two windows on: it has expired
+    assert limiter.limit == 10
+
+
+# ── Test 11: a non-positive rate is rejected up front ────────────────────────
+
+def test_bucket_rejects_zero_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, capacity=10)
+    with pytest.raises(ValueError):
+        TokenBucket(rate=-1, capacity=10)
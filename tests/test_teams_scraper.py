@@ -0,0 +1,71 @@
+"""
+tests/test_teams_scraper.py — Unit tests for the drive walk.
+
+Test matrix:
+  1. test_walk_processes_every_file_once — paged, nested tree wider than one
+       /$batch, a tiny download queue, an unlistable folder → every changed
+       file downloaded exactly once, unchanged ones skipped, and the walk ends
+
+The drive is tests/fakes.FakeDrive; downloads are recorded instead of run.
+"""
+import asyncio
+from collections import Counter
+
+from src import teams_scraper
+from src.graph_client import BATCH_LIMIT
+from src.ratelimit import AdmissionController
+from tests.fakes import FakeDrive
+
+
+def _tree(folders: int, files_per_folder: int) -> dict:
+    """root → `folders` folders, each with a subfolder; files at every level."""
+    def files(parent: str, n: int) -> list:
+        return [
+            {"id": f"{parent}-f{i}", "name": f"{parent}-f{i}.pdf", "eTag": "e1", "file": {}}
+            for i in range(n)
+        ]
+
+    tree = {"root": files("root", 2)}
+    for n in range(folders):
+        folder, sub = f"d{n}", f"d{n}s"
+        tree["root"].append({"id": folder, "name": folder, "folder": {}})
+        tree[folder] = files(folder, files_per_folder) + [{"id": sub, "name": sub, "folder": {}}]
+        tree[sub]    = files(sub, files_per_folder)
+    tree["root"].append({"id": "locked", "name": "locked", "folder": {}})   # fails to list
+    return tree
+
+
+# ── Test 1: every file exactly once, and the walk terminates ─────────────────
+
+async def test_walk_processes_every_file_once(scraper_db, monkeypatch):
+    monkeypatch.setattr(teams_scraper, "WALK_QUEUE_SIZE", 2)      # constant back-pressure
+    monkeypatch.setattr(teams_scraper, "DOWNLOAD_CONCURRENCY", 3)
+    downloaded = []
+    known      = {}
+
+    async def download(graph, pool, admission, stats, **kwargs):
+        await asyncio.sleep(0)
+        downloaded.append(kwargs["item"]["id"])
+        known[kwargs["item"]["id"]] = kwargs["known_etag"]
+
+    monkeypatch.setattr(teams_scraper, "_download_with_semaphore", download)
+
+    tree  = _tree(folders=BATCH_LIMIT + 5, files_per_folder=7)
+    drive = FakeDrive(tree, page_size=3)
+    scraper_db.class_etags = {"root-f0": "e1"}                    # unchanged, this class
+    scraper_db.etags       = {"d3-f1": "e1", "d4-f2": "old"}      # unchanged / changed
+    stats = teams_scraper.ScrapingStats()
+
+    await asyncio.wait_for(
+        teams_scraper._walk_drive(
+            drive, None, AdmissionController(3), stats,
+            drive_id="drive-1", root_item_id="root", class_id=None, label="Team/General",
+        ),
+        timeout=5,
+    )
+
+    every_file = [c["id"] for children in tree.values() for c in children if "file" in c]
+    assert Counter(downloaded) == Counter(set(every_file) - {"root-f0", "d3-f1"})
+    assert stats[teams_scraper.ScrapingStats.FILES_SKIPPED] == 2
+    assert known["d4-f2"] == "old"                                # download is conditional
+    assert len(drive.listed) == len(set(drive.listed))            # no page listed twice